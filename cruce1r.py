@@ -1,36 +1,12 @@
+import argparse
 import pandas as pd
 import openpyxl
 from pathlib import Path
 from collections import defaultdict
-import re
-
-def clean_id(id_value):
-    """Limpia y normaliza un ID para asegurar que sea un string de 16 dígitos."""
-    if pd.isna(id_value):
-        return None
-        
-    # Convierte a string y elimina espacios y caracteres no deseados
-    id_str = str(id_value).strip().replace('\xa0', '')
-    
-    # Elimina ".0" al final si existe (común en números leídos como float)
-    if id_str.endswith('.0'):
-        id_str = id_str[:-2]
-    
-    # Maneja notación científica
-    if 'e' in id_str.lower():
-        try:
-            return str(int(float(id_str)))
-        except:
-            return id_str
-    
-    # Elimina caracteres no numéricos
-    id_str = re.sub(r'\D', '', id_str)
-    
-    # Verifica si tiene exactamente 16 dígitos
-    if len(id_str) == 16:
-        return id_str
-    else:
-        return None  # No es un ID válido si no tiene 16 dígitos
+import ids
+import particiones
+import indice
+import plan_cambios
 
 def normalize_value(val):
     """Convierte un valor a cadena de forma consistente.
@@ -73,25 +49,11 @@ def relevant_columns_signature(data_list):
             values.append("")
     return tuple(values)
 
-def process_excel():
-    base_path = Path.cwd()
-    print(f"Directorio actual: {base_path}")
-    
-    # Procesar TODOS los Excel de REPORTE-ML (cualquier nombre, extensión .xls o .xlsx)
-    reporte_files = list(base_path.joinpath('REPORTE-ML').glob('*.xls*'))
-    if not reporte_files:
-        print("No se encontraron archivos Excel en REPORTE-ML")
-        return
-    print("Archivos encontrados en REPORTE-ML:")
-    for f in reporte_files:
-        print(f"- {f.name}")
-    
-    concentrado_path = base_path.joinpath('RESULTADO-FINAL', 'CONCENTRADO-MERCADOLIBRE.xlsx')
-    if not concentrado_path.exists():
-        print("No se encontró el archivo CONCENTRADO-MERCADOLIBRE.xlsx")
-        return
-    
-    print("\nProcesando archivos de reporte...")
+def cargar_reportes(reporte_files):
+    """
+    Lee los Excel de REPORTE-ML y construye el diccionario de datos del reporte:
+    la primera columna es el ID y se toma toda la información restante.
+    """
     all_report_data = []
     invalid_files = []
     
@@ -106,7 +68,8 @@ def process_excel():
                 continue
                 
             # Verificar si hay al menos un ID válido de 16 dígitos en la columna A
-            valid_ids = df.iloc[:, 0].apply(lambda x: clean_id(x) is not None).sum()
+            _, validos = ids.normalizar_ids(df.iloc[:, 0], ids.DIGITOS_ORDEN)
+            valid_ids = int(validos.sum())
             if valid_ids == 0:
                 print(f"Advertencia: {reporte_path.name} no contiene IDs válidos de 16 dígitos en la columna A")
                 invalid_files.append(reporte_path.name)
@@ -119,68 +82,58 @@ def process_excel():
             invalid_files.append(reporte_path.name)
     
     if not all_report_data:
-        print("No hay archivos de reporte válidos para procesar")
-        return
+        return None, invalid_files
         
     reporte = pd.concat(all_report_data, ignore_index=True)
     print(f"\nTotal registros combinados: {len(reporte)}")
     
-    # Construir diccionario de datos del reporte:
-    # La primera columna es el ID y se toma toda la información restante.
+    # Las claves son los IDs de 16 dígitos como enteros (ver ids.normalizar_ids)
+    claves, validos = ids.normalizar_ids(reporte.iloc[:, 0], ids.DIGITOS_ORDEN)
+    datos = reporte.iloc[:, 1:].to_numpy(dtype=object)
     reporte_dict = defaultdict(list)
-    ml_ids_not_found = set()  # Para almacenar IDs que no se encuentran en el concentrado
-    
-    for _, row in reporte.iterrows():
-        id_value = clean_id(row.iloc[0])
-        if id_value:
-            reporte_dict[id_value].append({
-                'data': row.iloc[1:].tolist(),
-                'used': False
-            })
+    for clave, data in zip(claves[validos].tolist(), datos[validos]):
+        reporte_dict[clave].append({
+            'data': data.tolist(),
+            'used': False
+        })
     print(f"IDs únicos en reportes: {len(reporte_dict)}")
-    
-    wb_concentrado = openpyxl.load_workbook(concentrado_path)
-    ws_concentrado = wb_concentrado.active
+    return reporte_dict, invalid_files
 
-    # Recorrer las filas existentes del concentrado (a partir de la fila 2) y extraer datos desde la columna A
-    existing_rows = defaultdict(list)
-    max_consecutive = 0  # Para llevar el control del mayor consecutivo encontrado
-    
-    for row in range(2, ws_concentrado.max_row + 1):
-        id_value = clean_id(ws_concentrado.cell(row=row, column=1).value)
-        
-        # Obtener el consecutivo (columna B)
-        consecutivo = ws_concentrado.cell(row=row, column=2).value
-        if isinstance(consecutivo, (int, float)) and consecutivo > max_consecutive:
-            max_consecutive = consecutivo
-            
-        # Obtener observaciones (columna C)
-        observaciones = ws_concentrado.cell(row=row, column=3).value
-        
-        if id_value:
-            # row_data = columnas desde la 4 hasta el final
-            row_data = [ws_concentrado.cell(row=row, column=col).value 
-                        for col in range(4, ws_concentrado.max_column + 1)]
-            existing_rows[id_value].append((row, consecutivo, observaciones, row_data))
+def cruzar_hoja(ws_concentrado, reporte_dict, indice_concentrado, plan):
+    """
+    Cruza una hoja del concentrado (el libro combinado o una partición) contra los datos del reporte.
+    Las filas de cada ID se obtienen del índice persistente del libro en lugar de recorrer toda la hoja.
+    La hoja no se modifica: los cambios reales se registran en `plan` (ver plan_cambios.PlanCambios).
+    Devuelve un diccionario con las estadísticas y los IDs del reporte presentes en la hoja.
+    """
+    if indice_concentrado.preparar(ws_concentrado):
+        print("Índice del concentrado reconstruido")
+    max_consecutive = indice_concentrado.max_consecutive
     
-    print(f"IDs en concentrado: {len(existing_rows)}")
+    print(f"IDs en concentrado: {indice_concentrado.contar('orden')}")
     print(f"Mayor consecutivo encontrado: {max_consecutive}")
     
-    # Verificar qué IDs de reporte_dict no existen en existing_rows
-    for id_value in reporte_dict.keys():
-        if id_value not in existing_rows:
-            ml_ids_not_found.add(id_value)
+    # IDs del reporte que existen en la hoja, en el orden en que aparecen
+    filas_por_id = indice_concentrado.buscar('orden', reporte_dict.keys())
+    ids_encontrados = sorted(filas_por_id, key=lambda id_value: filas_por_id[id_value][0])
     
-    changes_made = False
     updated_rows = 0
+    unchanged_rows = 0
     new_rows_count = 0
     duplicates_omitted_global = 0  # Contador de filas duplicadas omitidas
     
     # Primero actualizamos filas existentes y agregamos nuevas filas para IDs existentes
     print("\nActualizando datos y agregando filas para IDs existentes (comparando solo columnas J, N, O, R, U)...")
-    for id_value, rows_info in existing_rows.items():
-        if id_value not in reporte_dict:
-            continue
+    for id_value in ids_encontrados:
+        rows_info = []
+        for row in filas_por_id[id_value]:
+            # Obtener el consecutivo (columna B) y las observaciones (columna C)
+            consecutivo = ws_concentrado.cell(row=row, column=2).value
+            observaciones = ws_concentrado.cell(row=row, column=3).value
+            # row_data = columnas desde la 4 hasta el final
+            row_data = [ws_concentrado.cell(row=row, column=col).value 
+                        for col in range(4, ws_concentrado.max_column + 1)]
+            rows_info.append((row, consecutivo, observaciones, row_data))
             
         # Verificar todas las entradas en reporte_dict para este ID
         entries_to_process = reporte_dict[id_value].copy()
@@ -193,19 +146,19 @@ def process_excel():
             
             # Actualizar la primera fila existente con los nuevos datos
             # Modificación: iniciar la actualización desde la columna I (índice 9) en lugar de la columna D (índice 4)
+            # Solo se registran las celdas cuyo valor o formato realmente cambia
+            celdas_cambiadas = 0
             for col_idx, value in enumerate(first_entry['data'], start=9):
-                cell = ws_concentrado.cell(row=first_row_num, column=col_idx, value=value)
-                if isinstance(value, (int, float)):
-                    if isinstance(value, float) and not value.is_integer():
-                        cell.number_format = "0.00"
-                    else:
-                        cell.number_format = "0"
+                if plan.asignar(ws_concentrado, first_row_num, col_idx, value, plan_cambios.formato_numerico(value)):
+                    celdas_cambiadas += 1
             
             # Marcar como usada la primera entrada
             reporte_dict[id_value][0]['used'] = True
-            updated_rows += 1
-            changes_made = True
-            print(f"Actualizada fila {first_row_num} para ID {id_value}")
+            if celdas_cambiadas:
+                updated_rows += 1
+                print(f"Actualizada fila {first_row_num} para ID {id_value} ({celdas_cambiadas} celdas)")
+            else:
+                unchanged_rows += 1
             
             # Procesar las entradas restantes (añadir como nuevas filas) solo si
             # en las columnas J, N, O, R, U no coinciden con alguna fila existente
@@ -230,7 +183,7 @@ def process_excel():
                         # Crear nueva fila con mismo ID, consecutivo y observaciones
                         # Modificación: iniciar la inserción de datos a partir de la columna I (índice 9)
                         new_row = [None] * max(ws_concentrado.max_column, 8 + len(entry['data']))
-                        new_row[0] = id_value  # ID
+                        new_row[0] = ids.formatear_id(id_value, ids.DIGITOS_ORDEN)  # ID
                         new_row[1] = consecutivo  # Mismo consecutivo
                         new_row[2] = observaciones  # Mismas observaciones
                         
@@ -252,55 +205,162 @@ def process_excel():
                 
                 if new_rows:
                     # Insertar justo después de la última fila con el mismo ID
+                    # Modificación: aplicar formato desde la columna I en adelante (col_idx >= 9)
                     last_row = max(row for (row, _, _, _) in rows_info)
                     insert_at = last_row + 1
-                    
-                    ws_concentrado.insert_rows(insert_at, amount=len(new_rows))
-                    for i, row_data in enumerate(new_rows):
-                        target_row = insert_at + i
-                        for col_idx, value in enumerate(row_data, start=1):
-                            cell = ws_concentrado.cell(row=target_row, column=col_idx, value=value)
-                            # Modificación: aplicar formato desde la columna I en adelante (col_idx >= 9)
-                            if col_idx >= 9 and isinstance(value, (int, float)):
-                                if isinstance(value, float) and not value.is_integer():
-                                    cell.number_format = "0.00"
-                                else:
-                                    cell.number_format = "0"
+                    plan.insertar(insert_at, new_rows, formatear_desde=9)
                     
                     new_rows_count += len(new_rows)
-                    print(f"Para ID {id_value}, se insertaron {len(new_rows)} fila(s) a partir de la fila {insert_at}")
-                    changes_made = True
+                    print(f"Para ID {id_value}, se insertarán {len(new_rows)} fila(s) después de la fila {last_row}")
                 
                 duplicates_omitted_global += duplicates_omitted
     
+    return {
+        'changes_made': not plan.vacio(),
+        'updated_rows': updated_rows,
+        'unchanged_rows': unchanged_rows,
+        'new_rows_count': new_rows_count,
+        'duplicates_omitted': duplicates_omitted_global,
+        'ids_encontrados': set(ids_encontrados),
+        'max_consecutive': max_consecutive,
+    }
+
+def reportar_no_encontrados(ml_ids_not_found, reporte_dict):
     # Generar informe de IDs no encontrados
     if ml_ids_not_found:
         print("\n=== REPORTE DE IDS NO ENCONTRADOS EN CONCENTRADO ===")
         print(f"Se encontraron {len(ml_ids_not_found)} IDs en archivos de reporte que NO existen en el concentrado.")
         print("Estos IDs no fueron procesados:")
         for id_value in sorted(ml_ids_not_found):
-            print(f"- {id_value} (aparece {len(reporte_dict[id_value])} veces en los reportes)")
+            print(f"- {ids.formatear_id(id_value, ids.DIGITOS_ORDEN)} (aparece {len(reporte_dict[id_value])} veces en los reportes)")
         print("=======================================================")
 
-    if changes_made:
-        timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = concentrado_path.parent / f"CONCENTRADO-MERCADOLIBRE_backup_{timestamp}.xlsx"
-        wb_concentrado.save(backup_path)
+def reportar_resumen(stats, invalid_files):
+    print("\n=== RESUMEN DE PROCESAMIENTO ===")
+    print(f"Total filas actualizadas: {stats['updated_rows']}")
+    print(f"Filas sin cambios: {stats['unchanged_rows']}")
+    print(f"Total filas nuevas agregadas: {stats['new_rows_count']}")
+    print(f"Filas duplicadas omitidas: {stats['duplicates_omitted']}")
+    if invalid_files:
+        print(f"Archivos no procesados: {len(invalid_files)}")
+        for f in invalid_files:
+            print(f"- {f}")
+    print("================================")
+
+def procesar_particiones(base_path, manifest, reporte_dict, invalid_files, simulacion):
+    """Cruza el reporte solo contra las particiones cuyo rango de IDs puede contener coincidencias."""
+    carpeta = particiones.ruta_particiones(base_path)
+    candidatas = particiones.particiones_candidatas(manifest, reporte_dict.keys(), 'orden')
+    print(f"\nConcentrado particionado: {len(candidatas)} de {len(manifest['particiones'])} particiones con posibles coincidencias")
+    
+    totales = {'updated_rows': 0, 'unchanged_rows': 0, 'new_rows_count': 0, 'duplicates_omitted': 0}
+    ids_encontrados = set()
+    planes = []
+    particiones_modificadas = []
+    
+    for entrada in candidatas:
+        partition_path = carpeta / entrada['archivo']
+        print(f"\nProcesando partición {entrada['archivo']}...")
+        wb_partition = openpyxl.load_workbook(partition_path)
+        ws_partition = wb_partition.active
+        indice_partition = indice.IndiceConcentrado(partition_path)
+        plan = plan_cambios.PlanCambios(entrada['archivo'])
+        stats = cruzar_hoja(ws_partition, reporte_dict, indice_partition, plan)
+        ids_encontrados.update(stats['ids_encontrados'])
+        for clave in totales:
+            totales[clave] += stats[clave]
+        planes.append(plan)
+        # Las particiones sin cambios reales no se respaldan ni se guardan
+        if stats['changes_made'] and not simulacion:
+            plan.aplicar(ws_partition, indice_partition)
+            backup_path = particiones.guardar_con_backup(wb_partition, partition_path)
+            print(f"Backup creado en: {backup_path}")
+            indice_partition.sellar()
+            particiones.actualizar_entrada(manifest, entrada, ws_partition, partition_path)
+            particiones_modificadas.append(entrada['archivo'])
+        indice_partition.cerrar()
+        wb_partition.close()
+    
+    ml_ids_not_found = set(reporte_dict) - ids_encontrados
+    reportar_no_encontrados(ml_ids_not_found, reporte_dict)
+    
+    if simulacion:
+        reportar_simulacion(base_path, planes, totales, invalid_files)
+    elif particiones_modificadas:
+        particiones.guardar_manifest(base_path, manifest)
+        print(f"\nParticiones reescritas: {', '.join(particiones_modificadas)}")
+        reportar_resumen(totales, invalid_files)
+    else:
+        print("\nNo se requirieron cambios en el concentrado")
+
+def reportar_simulacion(base_path, planes, stats, invalid_files):
+    """Exporta el plan de cambios sin modificar el concentrado."""
+    reporte_path = plan_cambios.ruta_reporte_simulacion(base_path, 'cruce1r')
+    plan_cambios.exportar_planes(planes, reporte_path)
+    print("\n=== SIMULACIÓN: NO SE MODIFICÓ EL CONCENTRADO ===")
+    for plan in planes:
+        print(f"- {plan.archivo}: {plan.resumen()}")
+    print(f"Plan de cambios exportado en: {reporte_path}")
+    reportar_resumen(stats, invalid_files)
+
+def process_excel(simulacion=False):
+    base_path = Path.cwd()
+    print(f"Directorio actual: {base_path}")
+    
+    # Procesar TODOS los Excel de REPORTE-ML (cualquier nombre, extensión .xls o .xlsx)
+    reporte_files = list(base_path.joinpath('REPORTE-ML').glob('*.xls*'))
+    if not reporte_files:
+        print("No se encontraron archivos Excel en REPORTE-ML")
+        return
+    print("Archivos encontrados en REPORTE-ML:")
+    for f in reporte_files:
+        print(f"- {f.name}")
+    
+    # Si existe un concentrado particionado se usa en lugar del libro combinado
+    manifest = particiones.cargar_manifest(base_path)
+    concentrado_path = particiones.ruta_concentrado(base_path)
+    if manifest is None and not concentrado_path.exists():
+        print("No se encontró el archivo CONCENTRADO-MERCADOLIBRE.xlsx")
+        return
+    
+    print("\nProcesando archivos de reporte...")
+    reporte_dict, invalid_files = cargar_reportes(reporte_files)
+    if reporte_dict is None:
+        print("No hay archivos de reporte válidos para procesar")
+        return
+    
+    if manifest is not None:
+        procesar_particiones(base_path, manifest, reporte_dict, invalid_files, simulacion)
+        return
+    
+    wb_concentrado = openpyxl.load_workbook(concentrado_path)
+    ws_concentrado = wb_concentrado.active
+    indice_concentrado = indice.IndiceConcentrado(concentrado_path)
+    plan = plan_cambios.PlanCambios(concentrado_path.name)
+    stats = cruzar_hoja(ws_concentrado, reporte_dict, indice_concentrado, plan)
+    
+    # Verificar qué IDs de reporte_dict no existen en el concentrado
+    ml_ids_not_found = set(reporte_dict) - stats['ids_encontrados']
+    reportar_no_encontrados(ml_ids_not_found, reporte_dict)
+
+    if simulacion:
+        reportar_simulacion(base_path, [plan], stats, invalid_files)
+    elif stats['changes_made']:
+        plan.aplicar(ws_concentrado, indice_concentrado)
+        backup_path = particiones.guardar_con_backup(wb_concentrado, concentrado_path)
         print(f"\nBackup creado en: {backup_path}")
-        wb_concentrado.save(concentrado_path)
-        print("\n=== RESUMEN DE PROCESAMIENTO ===")
-        print(f"Total filas actualizadas: {updated_rows}")
-        print(f"Total filas nuevas agregadas: {new_rows_count}")
-        print(f"Filas duplicadas omitidas: {duplicates_omitted_global}")
-        if invalid_files:
-            print(f"Archivos no procesados: {len(invalid_files)}")
-            for f in invalid_files:
-                print(f"- {f}")
-        print("================================")
+        indice_concentrado.sellar()
+        reportar_resumen(stats, invalid_files)
     else:
+        # Sin cambios reales no se crea backup ni se reescribe el concentrado
         print("\nNo se requirieron cambios en el concentrado")
     
+    indice_concentrado.cerrar()
     wb_concentrado.close()
 
 if __name__ == "__main__":
-    process_excel()#
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Cruza los reportes de REPORTE-ML con el concentrado")
+    parser.add_argument("--simulacion", action="store_true",
+                        help="Calcula y exporta el plan de cambios sin modificar el concentrado")
+    args = parser.parse_args()
+    process_excel(simulacion=args.simulacion)
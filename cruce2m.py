@@ -1,11 +1,45 @@
+import argparse
 import pandas as pd
 import openpyxl
-from openpyxl.utils import get_column_letter
 from pathlib import Path
 import os
-from datetime import datetime
+import ids
+import particiones
+import indice
+import plan_cambios
+import estado_cruce
 
-def cross_excel_data():
+def cruzar_hoja(ws_concentrado, data_to_transfer, indice_concentrado, plan):
+    """
+    Busca coincidencias en la columna I de una hoja del concentrado (el libro combinado
+    o una partición) y registra en `plan` los cambios reales en D-H, sin modificar la hoja.
+    Las filas se ubican con el índice persistente del libro.
+    Devuelve (coincidencias, filas_con_cambios, total_filas, filas_encontradas), donde
+    `filas_encontradas` indica cuántas filas de la hoja tienen cada ID encontrado.
+    """
+    if indice_concentrado.preparar(ws_concentrado):
+        print("Índice del concentrado reconstruido")
+    
+    coincidencias = 0
+    filas_con_cambios = 0
+    total_filas = max(ws_concentrado.max_row - 1, 0)
+    filas_por_id = indice_concentrado.buscar('operacion', data_to_transfer.keys())
+    
+    for id_concentrado, filas in filas_por_id.items():
+        for row in filas:
+            coincidencias += 1
+            
+            # Transferir datos a las columnas D-H (columnas 4-8), con formato numérico si es necesario
+            cambios = 0
+            for i, valor in enumerate(data_to_transfer[id_concentrado]):
+                if plan.asignar(ws_concentrado, row, i + 4, valor, plan_cambios.formato_numerico(valor)):
+                    cambios += 1
+            if cambios:
+                filas_con_cambios += 1
+    
+    return coincidencias, filas_con_cambios, total_filas, {clave: len(filas) for clave, filas in filas_por_id.items()}
+
+def cross_excel_data(simulacion=False, completo=False):
     """
     Cruza datos entre el Excel en MERCADOEXCEL y el Excel CONCENTRADO-MERCADOLIBRE.xlsx
     
@@ -16,7 +50,10 @@ def cross_excel_data():
     Para cada coincidencia, copia la información del Excel de MERCADOEXCEL en las 
     columnas D a H del CONCENTRADO-MERCADOLIBRE.xlsx
     
-    Genera un reporte detallado incluyendo los IDs que no fueron encontrados.
+    Solo se cruzan los IDs que no se aplicaron en ejecuciones anteriores (ver estado_cruce);
+    con `completo` se cruzan todos. Los IDs no encontrados quedan pendientes en el estado y
+    se exportan a IDs_no_encontrados.csv.
+    Con `simulacion` solo se exporta el plan de cambios y el concentrado no se modifica.
     """
     try:
         base_path = Path.cwd()
@@ -37,9 +74,10 @@ def cross_excel_data():
         mercado_excel_path = excel_files[0]
         print(f"Usando archivo: {mercado_excel_path.name}")
         
-        # Verificar que exista el Excel CONCENTRADO-MERCADOLIBRE.xlsx
-        concentrado_path = base_path.joinpath('RESULTADO-FINAL', 'CONCENTRADO-MERCADOLIBRE.xlsx')
-        if not concentrado_path.exists():
+        # Verificar que exista el Excel CONCENTRADO-MERCADOLIBRE.xlsx (o su versión particionada)
+        manifest = particiones.cargar_manifest(base_path)
+        concentrado_path = particiones.ruta_concentrado(base_path)
+        if manifest is None and not concentrado_path.exists():
             print("Error: No se encontró el archivo CONCENTRADO-MERCADOLIBRE.xlsx")
             return
         
@@ -59,158 +97,188 @@ def cross_excel_data():
             print(f"Error: El archivo {mercado_excel_path.name} debe tener al menos 3 columnas")
             return
         
-        # Extraer los IDs de operación (columna C - índice 2)
-        # Convertir a string y asegurar que sean de 11 dígitos
-        df_mercado['ID_LIMPIO'] = df_mercado.iloc[:, 2].astype(str).str.replace(r'\D', '', regex=True)
-        ids_validos = df_mercado[df_mercado['ID_LIMPIO'].str.len() == 11]
+        # Extraer los IDs de operación (columna C - índice 2) como claves enteras de 11 dígitos
+        claves, validos = ids.normalizar_ids(df_mercado.iloc[:, 2], ids.DIGITOS_OPERACION)
+        total_validos = int(validos.sum())
         
         # Mostrar detalle de limpieza de IDs
         print("\n[DETALLE DE LIMPIEZA DE IDs]")
         print(f"- Total de filas en el archivo: {len(df_mercado)}")
-        print(f"- Total de IDs después de limpieza: {len(ids_validos)}")
-        print(f"- IDs descartados: {len(df_mercado) - len(ids_validos)}")
+        print(f"- Total de IDs después de limpieza: {total_validos}")
+        print(f"- IDs descartados: {len(df_mercado) - total_validos}")
         
-        if len(ids_validos) < len(df_mercado):
+        if total_validos < len(df_mercado):
             # Mostrar ejemplos de IDs descartados
-            ids_descartados = df_mercado[~df_mercado['ID_LIMPIO'].str.len().eq(11)]
+            ids_descartados = df_mercado[~validos]
             print("\nEjemplos de IDs descartados (no tienen 11 dígitos):")
             for idx, row in ids_descartados.head(5).iterrows():
-                print(f"  Fila {idx+1}: Valor original: '{row.iloc[2]}', Después de limpieza: '{row['ID_LIMPIO']}' (longitud: {len(row['ID_LIMPIO'])})")
+                print(f"  Fila {idx+1}: Valor original: '{row.iloc[2]}'")
         
-        if len(ids_validos) == 0:
+        if total_validos == 0:
             print(f"Error: No se encontraron IDs de operación válidos (11 dígitos) en la columna C")
             return
         
-        print(f"Se encontraron {len(ids_validos)} IDs de operación válidos en MERCADOEXCEL")
-        
-        # Cargar el archivo CONCENTRADO-MERCADOLIBRE.xlsx usando openpyxl para modificación
-        wb_concentrado = openpyxl.load_workbook(concentrado_path)
-        ws_concentrado = wb_concentrado.active
+        print(f"Se encontraron {total_validos} IDs de operación válidos en MERCADOEXCEL")
         
         # Preparar datos para transferir (las primeras 5 columnas de MERCADOEXCEL serán mapeadas a columnas D-H)
-        data_to_transfer = {}
-        for _, row in ids_validos.iterrows():
-            id_operacion = row['ID_LIMPIO']
-            # Obtener los valores de las primeras 5 columnas (si hay menos, se llenan con None)
-            valores = [row.iloc[i] if i < df_mercado.shape[1] else None for i in range(5)]
-            data_to_transfer[id_operacion] = valores
+        # Si hay menos de 5 columnas, se llenan con None
+        valores = df_mercado.iloc[validos, :5].to_numpy(dtype=object).tolist()
+        faltantes = [None] * (5 - min(df_mercado.shape[1], 5))
+        data_to_transfer = {clave: fila + faltantes for clave, fila in zip(claves[validos].tolist(), valores)}
+        
+        # Estado persistente del cruce: solo se procesan los IDs nuevos o con datos distintos y,
+        # si el concentrado cambió desde la última ejecución, los pendientes y los aplicados
+        # cuya cantidad de filas en la columna I ya no es la misma
+        estado = estado_cruce.EstadoCruce(base_path)
+        concentrado_cambio = estado.sello_guardado() != estado_cruce.sello_concentrado(base_path, manifest)
+        if completo:
+            a_procesar, omitidos = data_to_transfer, 0
+        else:
+            filas_actuales = None
+            if concentrado_cambio:
+                filas_actuales = estado_cruce.filas_en_concentrado(base_path, manifest, data_to_transfer.keys())
+            a_procesar, omitidos = estado.seleccionar(data_to_transfer, concentrado_cambio, filas_actuales)
+        
+        print("\n[CRUCE INCREMENTAL]")
+        print(f"- IDs a procesar en esta ejecución: {len(a_procesar)}")
+        print(f"- IDs omitidos (sin cambios desde la ejecución anterior): {omitidos}")
+        if not concentrado_cambio:
+            print("- El concentrado no cambió: los IDs pendientes no se vuelven a buscar")
         
         # Buscar coincidencias en la columna I del CONCENTRADO-MERCADOLIBRE y actualizar D-H
+        # Solo se respaldan y guardan los libros cuyo plan de cambios no está vacío
+        backup_paths = []
+        planes = []
         coincidencias = 0
+        filas_con_cambios = 0
         total_filas = 0
-        
-        for row in range(2, ws_concentrado.max_row + 1):
-            total_filas += 1
-            # Columna I es la 9
-            id_cell = ws_concentrado.cell(row=row, column=9).value
-            
-            # Limpiar el ID para comparación
-            if id_cell is not None:
-                id_concentrado = str(id_cell).strip().replace('\xa0', '')
-                # Eliminar ".0" al final si existe
-                if id_concentrado.endswith('.0'):
-                    id_concentrado = id_concentrado[:-2]
-                # Eliminar caracteres no numéricos
-                id_concentrado = ''.join(filter(str.isdigit, id_concentrado))
-                
-                # Verificar que tenga 11 dígitos
-                if len(id_concentrado) == 11 and id_concentrado in data_to_transfer:
-                    coincidencias += 1
-                    
-                    # Transferir datos a las columnas D-H (columnas 4-8)
-                    for i, valor in enumerate(data_to_transfer[id_concentrado]):
-                        col_letter = get_column_letter(i + 4)  # D=4, E=5, F=6, G=7, H=8
-                        ws_concentrado[f"{col_letter}{row}"] = valor
-                        
-                        # Aplicar formato numérico si es necesario
-                        if isinstance(valor, (int, float)):
-                            if isinstance(valor, float) and not valor.is_integer():
-                                ws_concentrado[f"{col_letter}{row}"].number_format = "0.00"
-                            else:
-                                ws_concentrado[f"{col_letter}{row}"].number_format = "0"
-        
-        # Identificar IDs no encontrados para el reporte
-        ids_encontrados = set()
-        for row in range(2, ws_concentrado.max_row + 1):
-            id_cell = ws_concentrado.cell(row=row, column=9).value
-            if id_cell is not None:
-                id_concentrado = str(id_cell).strip().replace('\xa0', '')
-                if id_concentrado.endswith('.0'):
-                    id_concentrado = id_concentrado[:-2]
-                id_concentrado = ''.join(filter(str.isdigit, id_concentrado))
-                if len(id_concentrado) == 11:
-                    ids_encontrados.add(id_concentrado)
-        
-        # Lista de IDs no encontrados
-        ids_no_encontrados = []
-        for id_operacion in data_to_transfer.keys():
-            if id_operacion not in ids_encontrados:
-                ids_no_encontrados.append(id_operacion)
-        
-        # Guardar listado de IDs no encontrados en un archivo de texto
-        reporte_path = base_path / "IDs_no_encontrados.txt"
-        with open(reporte_path, 'w') as f:
-            f.write(f"=== REPORTE DE IDs NO ENCONTRADOS ===\n")
-            f.write(f"Fecha y hora: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Archivo origen: {mercado_excel_path.name}\n")
-            f.write(f"Total IDs no encontrados: {len(ids_no_encontrados)}\n\n")
-            if ids_no_encontrados:
-                f.write("LISTADO DE IDs NO ENCONTRADOS:\n")
-                for i, id_op in enumerate(ids_no_encontrados, 1):
-                    # Obtener los datos asociados a este ID
-                    valores = data_to_transfer[id_op]
-                    valores_str = ', '.join(str(v) if v is not None else 'None' for v in valores)
-                    f.write(f"{i}. ID: {id_op} - Datos: {valores_str}\n")
-            else:
-                f.write("Todos los IDs fueron encontrados y procesados.\n")
-        
-        # Si se hicieron cambios, guardar el archivo
-        if coincidencias > 0:
-            # Crear backup
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = concentrado_path.parent / f"CONCENTRADO-MERCADOLIBRE_backup_{timestamp}.xlsx"
-            wb_concentrado.save(backup_path)
-            print(f"Backup creado en: {backup_path}")
+        filas_encontradas = {}
+        if not a_procesar:
+            print("No hay IDs nuevos ni pendientes por revisar. No se abrió el concentrado.")
+        elif manifest is None:
+            # Cargar el archivo CONCENTRADO-MERCADOLIBRE.xlsx usando openpyxl para modificación
+            wb_concentrado = openpyxl.load_workbook(concentrado_path)
+            ws_concentrado = wb_concentrado.active
+            indice_concentrado = indice.IndiceConcentrado(concentrado_path)
+            plan = plan_cambios.PlanCambios(concentrado_path.name)
+            coincidencias, filas_con_cambios, total_filas, filas_encontradas = cruzar_hoja(
+                ws_concentrado, a_procesar, indice_concentrado, plan)
+            planes.append(plan)
             
-            # Guardar cambios
-            wb_concentrado.save(concentrado_path)
+            # Si hay cambios reales, aplicarlos y guardar el archivo (con backup)
+            if not plan.vacio() and not simulacion:
+                plan.aplicar(ws_concentrado)
+                backup_paths.append(particiones.guardar_con_backup(wb_concentrado, concentrado_path))
+                print(f"Backup creado en: {backup_paths[-1]}")
+                indice_concentrado.sellar()
+            indice_concentrado.cerrar()
+            wb_concentrado.close()
+        else:
+            # Concentrado particionado: solo se abren las particiones cuyo rango de IDs puede coincidir
+            carpeta = particiones.ruta_particiones(base_path)
+            candidatas = particiones.particiones_candidatas(manifest, a_procesar.keys(), 'operacion')
+            print(f"\nConcentrado particionado: {len(candidatas)} de {len(manifest['particiones'])} particiones con posibles coincidencias")
+            for entrada in candidatas:
+                partition_path = carpeta / entrada['archivo']
+                wb_partition = openpyxl.load_workbook(partition_path)
+                ws_partition = wb_partition.active
+                indice_partition = indice.IndiceConcentrado(partition_path)
+                plan = plan_cambios.PlanCambios(entrada['archivo'])
+                coincidencias_part, cambios_part, filas_part, ids_part = cruzar_hoja(
+                    ws_partition, a_procesar, indice_partition, plan)
+                planes.append(plan)
+                coincidencias += coincidencias_part
+                filas_con_cambios += cambios_part
+                total_filas += filas_part
+                for clave, cantidad in ids_part.items():
+                    filas_encontradas[clave] = filas_encontradas.get(clave, 0) + cantidad
+                if not plan.vacio() and not simulacion:
+                    plan.aplicar(ws_partition)
+                    backup_paths.append(particiones.guardar_con_backup(wb_partition, partition_path))
+                    print(f"Backup creado en: {backup_paths[-1]}")
+                    indice_partition.sellar()
+                    particiones.actualizar_entrada(manifest, entrada, ws_partition, partition_path)
+                indice_partition.cerrar()
+                wb_partition.close()
+            if backup_paths:
+                particiones.guardar_manifest(base_path, manifest)
+        
+        # Registrar el resultado y exportar los IDs pendientes como reporte estructurado
+        ids_no_encontrados = [clave for clave in a_procesar if clave not in filas_encontradas]
+        if not simulacion:
+            estado.registrar(a_procesar, filas_encontradas, mercado_excel_path.name)
+            estado.guardar_sello(estado_cruce.sello_concentrado(base_path, manifest))
+        reporte_path = base_path / "IDs_no_encontrados.csv"
+        pendientes = estado.exportar_pendientes(reporte_path)
+        total_aplicados = estado.contar('aplicado')
+        estado.cerrar()
         
         # Mostrar reporte detallado
         print(f"\n=== REPORTE DETALLADO DE OPERACIÓN ===")
         print(f"Archivo origen: {mercado_excel_path.name}")
-        print(f"Archivo destino: {concentrado_path.name}")
+        if manifest is None:
+            print(f"Archivo destino: {concentrado_path.name}")
+        else:
+            print(f"Archivo destino: {concentrado_path.name} (particionado)")
         print(f"\n[ESTADÍSTICAS]")
         print(f"- Total de registros en el Excel origen: {len(df_mercado)}")
-        print(f"- Total de IDs de operación válidos (11 dígitos): {len(ids_validos)}")
-        print(f"- Total de filas en CONCENTRADO-MERCADOLIBRE: {total_filas}")
-        print(f"- Coincidencias encontradas y actualizadas: {coincidencias}")
-        print(f"- IDs no encontrados: {len(ids_no_encontrados)}")
+        print(f"- Total de IDs de operación válidos (11 dígitos): {total_validos}")
+        if a_procesar:
+            print(f"- Total de filas en CONCENTRADO-MERCADOLIBRE: {total_filas}")
+        else:
+            print("- Total de filas en CONCENTRADO-MERCADOLIBRE: no se abrió (no había IDs por revisar)")
+        print(f"- Coincidencias encontradas: {coincidencias}")
+        print(f"- Filas con cambios: {filas_con_cambios}")
+        print(f"- Filas sin cambios: {coincidencias - filas_con_cambios}")
+        print(f"- IDs no encontrados en esta ejecución: {len(ids_no_encontrados)}")
+        print(f"- IDs aplicados acumulados: {total_aplicados}")
+        print(f"- IDs pendientes acumulados: {len(pendientes)}")
         
-        if ids_no_encontrados:
+        if pendientes:
             print(f"\n[IDs NO ENCONTRADOS]")
             print(f"Se ha generado un archivo detallado en: {reporte_path}")
-            print("Listado resumido de IDs no encontrados:")
+            print(f"El estado completo del cruce se consulta en: {estado.estado_path}")
+        if ids_no_encontrados:
+            print("Listado resumido de IDs no encontrados en esta ejecución:")
             for i, id_op in enumerate(ids_no_encontrados[:10], 1):  # Mostrar solo los primeros 10
-                print(f"- {id_op}")
+                print(f"- {ids.formatear_id(id_op, ids.DIGITOS_OPERACION)}")
             if len(ids_no_encontrados) > 10:
                 print(f"... y {len(ids_no_encontrados) - 10} más (ver archivo de reporte)")
         
         print("\n[DETALLES DE OPERACIÓN]")
-        if coincidencias > 0:
-            print(f"- Se actualizaron {coincidencias} registros")
-            print(f"- Se creó un backup en: {backup_path}")
+        if simulacion:
+            plan_path = plan_cambios.ruta_reporte_simulacion(base_path, 'cruce2m')
+            plan_cambios.exportar_planes(planes, plan_path)
+            print("- Simulación: no se modificó el concentrado")
+            for plan in planes:
+                print(f"- {plan.archivo}: {plan.resumen()}")
+            print(f"- Plan de cambios exportado en: {plan_path}")
+        elif filas_con_cambios > 0:
+            print(f"- Se actualizaron {filas_con_cambios} registros")
+            for backup_path in backup_paths:
+                print(f"- Se creó un backup en: {backup_path}")
+        elif not a_procesar:
+            print("- No había IDs por revisar. No se hicieron cambios.")
+        elif coincidencias > 0:
+            print("- Los datos ya estaban actualizados. No se hicieron cambios.")
         else:
             print("- No se encontraron coincidencias. No se hicieron cambios.")
         
         print("================================")
-        
-        wb_concentrado.close()
     
     except Exception as e:
         print(f"Error durante el proceso: {str(e)}")
         import traceback
         print(traceback.format_exc())
+        # Código de salida distinto de cero para que el procesamiento por lotes detecte el fallo
+        raise SystemExit(1)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cruza el Excel de MERCADOEXCEL con el concentrado")
+    parser.add_argument("--simulacion", action="store_true",
+                        help="Calcula y exporta el plan de cambios sin modificar el concentrado")
+    parser.add_argument("--completo", action="store_true",
+                        help="Cruza todos los IDs, incluidos los ya aplicados en ejecuciones anteriores")
+    args = parser.parse_args()
     print("Iniciando cruce de datos entre Excel de MERCADOEXCEL y CONCENTRADO-MERCADOLIBRE...")
-    cross_excel_data()
\ No newline at end of file
+    cross_excel_data(simulacion=args.simulacion, completo=args.completo)
\ No newline at end of file
@@ -0,0 +1,161 @@
+import csv
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import ids
+import indice
+import particiones
+
+ESTADO_NOMBRE = 'ESTADO-CRUCE2M.sqlite'
+COLUMNAS_DATOS = ['Fecha', 'Descripción', 'ID de la operación', 'Valor', 'Saldo']
+
+
+def sello_concentrado(base_path, manifest):
+    """Fecha de modificación y tamaño del concentrado (o de todas sus particiones)."""
+    return '|'.join(f"{workbook_path.name}:{particiones.sello_libro(workbook_path)}"
+                    for workbook_path in particiones.libros_concentrado(base_path, manifest)
+                    if workbook_path.exists())
+
+
+def filas_en_concentrado(base_path, manifest, claves):
+    """
+    Cuenta las filas de la columna I que tiene cada ID consultando solo los índices persistentes,
+    sin cargar los libros. Devuelve None si algún índice no corresponde al libro en disco.
+    """
+    claves = list(claves)
+    filas = {}
+    for workbook_path in particiones.libros_concentrado(base_path, manifest):
+        if not workbook_path.exists():
+            continue
+        indice_libro = indice.IndiceConcentrado(workbook_path)
+        try:
+            if not indice_libro.vigente():
+                return None
+            for clave, filas_libro in indice_libro.buscar('operacion', claves).items():
+                filas[clave] = filas.get(clave, 0) + len(filas_libro)
+        finally:
+            indice_libro.cerrar()
+    return filas
+
+
+def _huella(valores):
+    return json.dumps(valores, default=str, ensure_ascii=False)
+
+
+class EstadoCruce:
+    """
+    Estado persistente del cruce de MERCADOEXCEL contra el concentrado.
+
+    Cada ID de operación queda como 'aplicado' (se encontró y sus datos se escribieron en D-H)
+    o 'pendiente' (aún no existe en la columna I del concentrado), junto con la huella de los
+    datos de origen y la cantidad de filas en las que se encontró. En la siguiente ejecución
+    solo se cruzan los IDs nuevos o con datos distintos; si el concentrado cambió desde la
+    última vez, también los pendientes y los aplicados cuya cantidad de filas ya no coincide.
+    """
+
+    def __init__(self, base_path):
+        self.estado_path = Path(base_path).joinpath('RESULTADO-FINAL', ESTADO_NOMBRE)
+        self.conn = sqlite3.connect(self.estado_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+            CREATE TABLE IF NOT EXISTS operaciones (
+                id INTEGER PRIMARY KEY,
+                estado TEXT NOT NULL,
+                huella TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                archivo_origen TEXT,
+                primera_vez TEXT NOT NULL,
+                ultima_revision TEXT NOT NULL,
+                revisiones INTEGER NOT NULL DEFAULT 1,
+                filas INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS operaciones_estado ON operaciones (estado);
+        """)
+        # Estados creados antes de registrar la cantidad de filas: se vuelven a revisar
+        columnas = {row[1] for row in self.conn.execute("PRAGMA table_info(operaciones)")}
+        if 'filas' not in columnas:
+            self.conn.execute("ALTER TABLE operaciones ADD COLUMN filas INTEGER")
+
+    def sello_guardado(self):
+        row = self.conn.execute("SELECT valor FROM meta WHERE clave = 'sello_concentrado'").fetchone()
+        return row[0] if row else None
+
+    def guardar_sello(self, sello):
+        self.conn.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES ('sello_concentrado', ?)", (sello,))
+        self.conn.commit()
+
+    def seleccionar(self, data_to_transfer, concentrado_cambio, filas_actuales=None):
+        """
+        Devuelve (a_procesar, omitidos): el subconjunto de `data_to_transfer` que hay que cruzar
+        y cuántos IDs se omiten. Con el concentrado sin cambios se omiten los aplicados y los
+        pendientes; si cambió, solo los aplicados cuya cantidad de filas en `filas_actuales`
+        sigue siendo la registrada (sin `filas_actuales` se revisan todos).
+        """
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS entrada (id INTEGER PRIMARY KEY)")
+        self.conn.execute("DELETE FROM entrada")
+        self.conn.executemany("INSERT OR IGNORE INTO entrada (id) VALUES (?)", ((c,) for c in data_to_transfer))
+        conocidos = {clave: (estado, huella, filas) for clave, estado, huella, filas in self.conn.execute(
+            "SELECT o.id, o.estado, o.huella, o.filas FROM operaciones o JOIN entrada e ON o.id = e.id")}
+
+        a_procesar = {}
+        for clave, valores in data_to_transfer.items():
+            previo = conocidos.get(clave)
+            if previo is None or previo[1] != _huella(valores):
+                # ID nuevo o con datos distintos a los ya aplicados
+                a_procesar[clave] = valores
+            elif not concentrado_cambio:
+                continue
+            elif previo[0] == 'pendiente':
+                a_procesar[clave] = valores
+            elif filas_actuales is None or filas_actuales.get(clave, 0) != previo[2]:
+                # Aplicado, pero el concentrado tiene filas nuevas (o menos) con este ID
+                a_procesar[clave] = valores
+        return a_procesar, len(data_to_transfer) - len(a_procesar)
+
+    def registrar(self, procesados, filas_encontradas, archivo_origen):
+        """
+        Guarda el resultado del cruce de los IDs procesados en esta ejecución;
+        `filas_encontradas` indica en cuántas filas del concentrado se encontró cada ID.
+        """
+        ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.conn.executemany("""
+            INSERT INTO operaciones (id, estado, huella, datos, archivo_origen, primera_vez, ultima_revision, filas)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                estado = excluded.estado, huella = excluded.huella, datos = excluded.datos,
+                archivo_origen = excluded.archivo_origen, ultima_revision = excluded.ultima_revision,
+                revisiones = revisiones + 1, filas = excluded.filas
+        """, (
+            (clave, 'aplicado' if filas_encontradas.get(clave) else 'pendiente', _huella(valores),
+             json.dumps(valores, default=str, ensure_ascii=False), archivo_origen, ahora, ahora,
+             filas_encontradas.get(clave, 0))
+            for clave, valores in procesados.items()
+        ))
+        self.conn.commit()
+
+    def contar(self, estado):
+        return self.conn.execute("SELECT COUNT(*) FROM operaciones WHERE estado = ?", (estado,)).fetchone()[0]
+
+    def pendientes(self):
+        """IDs pendientes (no encontrados en el concentrado), del más antiguo al más reciente."""
+        return self.conn.execute(
+            "SELECT id, datos, archivo_origen, primera_vez, ultima_revision, revisiones "
+            "FROM operaciones WHERE estado = 'pendiente' ORDER BY primera_vez, id").fetchall()
+
+    def exportar_pendientes(self, ruta):
+        """Exporta los IDs pendientes como CSV (una fila por ID, con sus datos de origen)."""
+        pendientes = self.pendientes()
+        with open(ruta, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ID'] + COLUMNAS_DATOS + ['Archivo origen', 'Primera vez', 'Última revisión', 'Revisiones'])
+            for clave, datos, archivo_origen, primera_vez, ultima_revision, revisiones in pendientes:
+                valores = json.loads(datos)
+                writer.writerow([ids.formatear_id(clave, ids.DIGITOS_OPERACION)]
+                                + ['' if v is None else v for v in valores]
+                                + [archivo_origen, primera_vez, ultima_revision, revisiones])
+        return pendientes
+
+    def cerrar(self):
+        self.conn.close()
@@ -1,4 +1,5 @@
 import os
+import argparse
 import pandas as pd
 import pdfplumber
 import re
@@ -6,21 +7,30 @@ from datetime import datetime
 from openpyxl import Workbook, load_workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import NamedStyle
+import ids
+
+# Encabezados que debe contener la primera página de un estado de cuenta
+ENCABEZADOS_ESTADO_CUENTA = ("Fecha", "Descripción", "ID de la operación")
 
 class EstadoCuentaProcessor:
-    def __init__(self, input_folder="MERCADOPDF", output_folder="MERCADOEXCEL", excel_file="estado_cuenta.xlsx"):
+    def __init__(self, input_folder="MERCADOPDF", output_folder="MERCADOEXCEL", excel_file="estado_cuenta.xlsx",
+                 forzar_extraccion=False):
         self.input_folder = input_folder
         self.output_folder = output_folder
         self.excel_file = excel_file
+        # Si es True se extraen todas las páginas aunque el sondeo no detecte un estado de cuenta
+        self.forzar_extraccion = forzar_extraccion
         self.processed_count = 0
         self.error_count = 0
         # Nuevos contadores para el reporte
         self.total_pdfs = 0
         self.pdfs_sin_datos = []
         self.pdfs_con_error = []
+        self.pdfs_omitidos_por_sondeo = []
         self.pdfs_procesados = []
         self.transacciones_por_pdf = {}
         self.pdfs_con_duplicados = set()
+        self.ids_invalidos = []
         os.makedirs(output_folder, exist_ok=True)
     
     def get_pdf_paths(self):
@@ -35,6 +45,12 @@ class EstadoCuentaProcessor:
         except Exception:
             return date_str
     
+    def es_estado_de_cuenta(self, texto_primera_pagina):
+        """Sondeo rápido: verifica que la primera página contenga los encabezados del estado de cuenta."""
+        if not texto_primera_pagina:
+            return False
+        return all(encabezado in texto_primera_pagina for encabezado in ENCABEZADOS_ESTADO_CUENTA)
+    
     def process_line(self, line):
         pattern = r'(\d{2}-\d{2}-\d{4})\s+(.*?)\s+(\d{11})\s+\$\s*([-\d,.]+)\s+\$\s*([-\d,.]+)'
         match = re.search(pattern, line)
@@ -65,9 +81,17 @@ class EstadoCuentaProcessor:
             
             try:
                 with pdfplumber.open(pdf_path) as pdf:
+                    # Sondeo de la primera página antes de extraer el documento completo
+                    texto_primera_pagina = pdf.pages[0].extract_text() if pdf.pages else None
+                    if not self.forzar_extraccion and not self.es_estado_de_cuenta(texto_primera_pagina):
+                        print("  Omitido: la primera página no contiene los encabezados del estado de cuenta")
+                        self.pdfs_omitidos_por_sondeo.append(pdf_name)
+                        continue
+                    
                     for page_num, page in enumerate(pdf.pages, 1):
                         print(f"  Procesando página {page_num} de {len(pdf.pages)}")
-                        text = page.extract_text()
+                        # La primera página ya se extrajo durante el sondeo
+                        text = texto_primera_pagina if page_num == 1 else page.extract_text()
                         if not text:
                             continue
                         lines = text.split('\n')
@@ -108,10 +132,13 @@ class EstadoCuentaProcessor:
         
         # Convertir la columna "Valor" a numérico en una columna auxiliar (para robustez en la comparación)
         df['Valor_num'] = df['Valor'].replace(r'[\$,]', '', regex=True).astype(float)
+        # Clave entera del ID (el patrón de extracción garantiza 11 dígitos) para agrupar sin comparar strings
+        claves, _ = ids.normalizar_ids(df['ID de la operación'], ids.DIGITOS_OPERACION)
+        df['ID_clave'] = claves
         
         # Para identificar duplicados entre PDFs
         duplicados_df = df.copy()
-        duplicados_por_id = duplicados_df.groupby(['ID de la operación', 'Valor_num']).filter(lambda x: len(x) > 1)
+        duplicados_por_id = duplicados_df.groupby(['ID_clave', 'Valor_num']).filter(lambda x: len(x) > 1)
         
         if not duplicados_por_id.empty:
             # Identificar qué PDFs tienen transacciones duplicadas
@@ -119,7 +146,7 @@ class EstadoCuentaProcessor:
             self.pdfs_con_duplicados.update(archivos_con_duplicados)
         
         # Aplicar la lógica de filtrado:
-        # Se agrupa por "ID de la operación" y "Valor_num". 
+        # Se agrupa por la clave de "ID de la operación" y "Valor_num". 
         # Si en un grupo los registros provienen de distintos PDFs (más de un valor único en "Orden"),
         # se conservan únicamente aquellos con el valor mínimo de "Orden".
         # Si todos son del mismo PDF, se mantienen todos.
@@ -131,13 +158,13 @@ class EstadoCuentaProcessor:
                 min_orden = grupo['Orden'].min()
                 return grupo[grupo['Orden'] == min_orden]
         
-        df_filtrado = df.groupby(['ID de la operación', 'Valor_num'], group_keys=False).apply(filtra_grupo)
+        df_filtrado = df.groupby(['ID_clave', 'Valor_num'], group_keys=False).apply(filtra_grupo)
         descartados = df_before - len(df_filtrado)
         if descartados > 0:
             print(f"Se descartaron {descartados} registros duplicados entre PDFs.")
         
-        # Eliminar la columna auxiliar
-        df_filtrado = df_filtrado.drop(columns=['Valor_num'])
+        # Eliminar las columnas auxiliares
+        df_filtrado = df_filtrado.drop(columns=['Valor_num', 'ID_clave'])
         
         return df_filtrado
     
@@ -154,7 +181,13 @@ class EstadoCuentaProcessor:
             date_style = NamedStyle(name='datetime', number_format='DD/MM/YYYY')
             
             # Conversión de columnas a los tipos deseados usando .loc para evitar SettingWithCopyWarning
-            df_to_save.loc[:, 'ID de la operación'] = pd.to_numeric(df_to_save['ID de la operación'], errors='coerce')
+            claves, validos = ids.normalizar_ids(df_to_save['ID de la operación'], ids.DIGITOS_OPERACION)
+            self.ids_invalidos = df_to_save.loc[~validos, 'ID de la operación'].astype(str).tolist()
+            if self.ids_invalidos:
+                print(f"Se omitieron {len(self.ids_invalidos)} registros con ID de operación inválido: "
+                      f"{', '.join(self.ids_invalidos)}")
+            df_to_save['ID de la operación'] = claves
+            df_to_save = df_to_save.loc[validos].copy()
             df_to_save.loc[:, 'Valor'] = df_to_save['Valor'].replace(r'[\$,]', '', regex=True).astype(float)
             df_to_save.loc[:, 'Saldo'] = df_to_save['Saldo'].replace(r'[\$,]', '', regex=True).astype(float)
             
@@ -165,9 +198,10 @@ class EstadoCuentaProcessor:
                 
                 # Extraer las IDs existentes (se asume que la ID de la operación está en la tercera columna)
                 existing_ids = set()
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    if row[2] is not None:
-                        existing_ids.add(row[2])
+                for (id_cell,) in ws.iter_rows(min_row=2, min_col=3, max_col=3, values_only=True):
+                    clave = ids.id_numerico(id_cell, ids.DIGITOS_OPERACION)
+                    if clave is not None:
+                        existing_ids.add(clave)
                 
                 df_new = df_to_save[~df_to_save['ID de la operación'].isin(existing_ids)]
                 if df_new.empty:
@@ -235,6 +269,7 @@ class EstadoCuentaProcessor:
         print(f"- Total de archivos PDF encontrados: {self.total_pdfs}")
         print(f"- PDFs procesados con éxito: {len(self.pdfs_procesados)}")
         print(f"- PDFs sin datos relevantes: {len(self.pdfs_sin_datos)}")
+        print(f"- PDFs omitidos por sondeo: {len(self.pdfs_omitidos_por_sondeo)}")
         print(f"- PDFs con errores: {len(self.pdfs_con_error)}")
         print(f"- PDFs con transacciones duplicadas: {len(self.pdfs_con_duplicados)}")
         
@@ -242,6 +277,7 @@ class EstadoCuentaProcessor:
         print("\n[DETALLES DE PROCESAMIENTO]")
         print(f"- Total de registros extraídos: {self.processed_count}")
         print(f"- Registros con error (excepciones): {self.error_count}")
+        print(f"- Registros con ID de operación inválido (no guardados): {len(self.ids_invalidos)}")
         print(f"- Registros nuevos agregados en este procesamiento: {nuevos_registros}")
         
         # Detalle por PDF
@@ -257,6 +293,17 @@ class EstadoCuentaProcessor:
             for pdf in self.pdfs_sin_datos:
                 print(f"- {pdf}")
         
+        if self.pdfs_omitidos_por_sondeo:
+            print("\n[PDFS OMITIDOS POR SONDEO]")
+            for pdf in self.pdfs_omitidos_por_sondeo:
+                print(f"- {pdf}")
+            print("  (use --forzar-extraccion para procesarlos completos)")
+        
+        if self.ids_invalidos:
+            print("\n[REGISTROS CON ID DE OPERACIÓN INVÁLIDO]")
+            for id_operacion in self.ids_invalidos:
+                print(f"- {id_operacion}")
+        
         if self.pdfs_con_error:
             print("\n[PDFS CON ERRORES]")
             for pdf in self.pdfs_con_error:
@@ -267,8 +314,12 @@ class EstadoCuentaProcessor:
         print("="*50)
 
 def main():
+    parser = argparse.ArgumentParser(description="Extrae transacciones de los estados de cuenta en PDF")
+    parser.add_argument("--forzar-extraccion", action="store_true",
+                        help="Extrae todas las páginas aunque el sondeo no detecte un estado de cuenta")
+    args = parser.parse_args()
     try:
-        processor = EstadoCuentaProcessor()
+        processor = EstadoCuentaProcessor(forzar_extraccion=args.forzar_extraccion)
         print("Iniciando procesamiento de los PDF...")
         df = processor.process_pdf()
         print("\nGuardando resultados en Excel...")
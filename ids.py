@@ -0,0 +1,79 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Cantidad de dígitos de cada tipo de ID
+DIGITOS_ORDEN = 16      # ORDEN ML (REPORTE-ML, columna A del concentrado)
+DIGITOS_OPERACION = 11  # ID de la operación (estados de cuenta, columna I del concentrado)
+
+# Solo los textos que son un número en notación científica (p. ej. '2.00000000000001E+15')
+PATRON_CIENTIFICO = r'^[\d.]+[eE][+-]?\d+$'
+
+
+def normalizar_ids(valores, digitos):
+    """
+    Convierte en bloque una columna de IDs a claves enteras (int64).
+
+    Devuelve (claves, validos): `claves` es un arreglo int64 con 0 donde el ID no es válido
+    y `validos` la máscara de los IDs que tienen exactamente `digitos` dígitos. Acepta columnas
+    numéricas (int o float, como las lee pandas) y columnas de texto o mixtas, con los mismos
+    criterios de limpieza que se usaban por fila: espacios, '\\xa0', sufijo '.0' y notación científica.
+    Un ID que empieza con cero no es válido en ningún caso, porque al guardarlo como número
+    perdería ese dígito y dejaría de reconocerse.
+    """
+    serie = pd.Series(valores) if not isinstance(valores, pd.Series) else valores
+    minimo, maximo = 10 ** (digitos - 1), 10 ** digitos - 1
+
+    if pd.api.types.is_integer_dtype(serie.dtype) and not pd.api.types.is_extension_array_dtype(serie.dtype):
+        claves = serie.to_numpy(dtype=np.int64)
+        validos = (claves >= minimo) & (claves <= maximo)
+        return np.where(validos, claves, 0), validos
+
+    if pd.api.types.is_float_dtype(serie.dtype) and not pd.api.types.is_extension_array_dtype(serie.dtype):
+        numeros = serie.to_numpy(dtype=np.float64)
+        validos = np.isfinite(numeros) & (numeros >= minimo) & (numeros <= maximo) & (np.floor(numeros) == numeros)
+        claves = np.where(validos, numeros, 0).astype(np.int64)
+        return claves, validos
+
+    # Texto o tipos mixtos: misma limpieza que se aplicaba a cada celda
+    texto = serie.astype(str).str.strip().str.replace('\xa0', '', regex=False)
+    texto = texto.str.replace(r'\.0$', '', regex=True)
+    cientificos = texto.str.match(PATRON_CIENTIFICO)
+    if cientificos.any():
+        convertidos = pd.to_numeric(texto[cientificos], errors='coerce')
+        convertidos = convertidos[convertidos.notna()]
+        texto = texto.copy()
+        texto[convertidos.index] = [str(int(v)) for v in convertidos]
+    digitos_str = texto.str.replace(r'\D', '', regex=True)
+    validos = ((digitos_str.str.len() == digitos) & ~digitos_str.str.startswith('0')).to_numpy()
+    claves = np.zeros(len(serie), dtype=np.int64)
+    if validos.any():
+        claves[validos] = digitos_str[validos].astype(np.int64).to_numpy()
+    return claves, validos
+
+
+def id_numerico(valor, digitos):
+    """Devuelve el ID como entero si tiene exactamente `digitos` dígitos (sin cero inicial), si no None."""
+    if valor is None:
+        return None
+    if isinstance(valor, (int, np.integer)) and not isinstance(valor, bool):
+        return int(valor) if 10 ** (digitos - 1) <= valor < 10 ** digitos else None
+    id_str = str(valor).strip().replace('\xa0', '')
+    if id_str.endswith('.0'):
+        id_str = id_str[:-2]
+    # Maneja notación científica
+    if re.match(PATRON_CIENTIFICO, id_str):
+        try:
+            id_str = str(int(float(id_str)))
+        except (ValueError, OverflowError):
+            pass
+    id_str = re.sub(r'\D', '', id_str)
+    if len(id_str) != digitos or id_str.startswith('0'):
+        return None
+    return int(id_str)
+
+
+def formatear_id(clave, digitos):
+    """Convierte una clave entera de vuelta al ID de `digitos` dígitos (conserva ceros a la izquierda)."""
+    return f"{int(clave):0{digitos}d}"
@@ -0,0 +1,169 @@
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+import ids
+import particiones
+
+# Tipos de ID indexados y su cantidad de dígitos
+TIPOS_ID = {
+    'orden': (particiones.COL_ORDEN, ids.DIGITOS_ORDEN),              # Columna A (cruce1r)
+    'operacion': (particiones.COL_OPERACION, ids.DIGITOS_OPERACION),  # Columna I (cruce2m)
+}
+VERSION_INDICE = '1'
+
+
+def ruta_indice(workbook_path):
+    """El índice vive junto al libro: CONCENTRADO-MERCADOLIBRE.xlsx -> CONCENTRADO-MERCADOLIBRE.indice.sqlite"""
+    workbook_path = Path(workbook_path)
+    return workbook_path.with_name(f"{workbook_path.stem}.indice.sqlite")
+
+
+class IndiceConcentrado:
+    """
+    Índice persistente ID -> fila para un libro del concentrado (el combinado o una partición).
+
+    Guarda los IDs de orden (columna A) y de operación (columna I) con su número de fila,
+    además del mayor consecutivo. Solo es válido mientras la fecha de modificación y el
+    tamaño del libro coincidan con los registrados al sellarlo; en cualquier otro caso se
+    reconstruye a partir de la hoja cargada.
+    """
+
+    def __init__(self, workbook_path):
+        self.workbook_path = Path(workbook_path)
+        self.conn = sqlite3.connect(ruta_indice(self.workbook_path))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+            CREATE TABLE IF NOT EXISTS ids (tipo TEXT NOT NULL, id INTEGER NOT NULL, fila INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS ids_tipo_id ON ids (tipo, id);
+            CREATE INDEX IF NOT EXISTS ids_fila ON ids (fila);
+        """)
+        self._modificado = False
+
+    def _meta(self, clave):
+        row = self.conn.execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, clave, valor):
+        self.conn.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)",
+                          (clave, None if valor is None else str(valor)))
+
+    def vigente(self):
+        """Indica si el índice corresponde al libro tal como está en disco."""
+        return (self._meta('version') == VERSION_INDICE
+                and self.workbook_path.exists()
+                and self._meta('sello') == particiones.sello_libro(self.workbook_path))
+
+    @property
+    def max_consecutive(self):
+        valor = self._meta('max_consecutive')
+        return int(valor) if valor else 0
+
+    def _leer_fila(self, ws, fila):
+        registros = []
+        for tipo, (columna, digitos) in TIPOS_ID.items():
+            clave = ids.id_numerico(ws.cell(row=fila, column=columna).value, digitos)
+            if clave is not None:
+                registros.append((tipo, clave, fila))
+        return registros
+
+    def _ampliar_consecutivo(self, consecutivo):
+        if isinstance(consecutivo, (int, float)) and consecutivo > self.max_consecutive:
+            self._set_meta('max_consecutive', int(consecutivo))
+
+    def reconstruir(self, ws):
+        """Reconstruye el índice completo a partir de la hoja y lo sella contra el libro en disco."""
+        self.conn.execute("DELETE FROM ids")
+        filas = list(ws.iter_rows(min_row=2, max_col=particiones.COL_OPERACION, values_only=True))
+        registros = []
+        for tipo, (columna, digitos) in TIPOS_ID.items():
+            # dtype object evita que pandas convierta IDs de 16 dígitos a float
+            valores = pd.Series([row[columna - 1] if len(row) >= columna else None for row in filas], dtype=object)
+            claves, validos = ids.normalizar_ids(valores, digitos)
+            numeros_fila = np.flatnonzero(validos) + 2
+            registros.extend((tipo, clave, fila) for clave, fila in zip(claves[validos].tolist(), numeros_fila.tolist()))
+        max_consecutive = 0
+        for row in filas:
+            consecutivo = row[particiones.COL_CONSECUTIVO - 1] if len(row) >= particiones.COL_CONSECUTIVO else None
+            if isinstance(consecutivo, (int, float)) and consecutivo > max_consecutive:
+                max_consecutive = int(consecutivo)
+        self.conn.executemany("INSERT INTO ids (tipo, id, fila) VALUES (?, ?, ?)", registros)
+        self._set_meta('version', VERSION_INDICE)
+        self._set_meta('max_consecutive', max_consecutive)
+        self._modificado = False
+        self.sellar()
+        return len(registros)
+
+    def preparar(self, ws):
+        """Reconstruye el índice si no corresponde al libro en disco. Devuelve True si se reconstruyó."""
+        if self.vigente():
+            return False
+        self.reconstruir(ws)
+        return True
+
+    def buscar(self, tipo, claves):
+        """Devuelve {clave: [filas]} para las claves enteras presentes en el libro."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS buscados (id INTEGER PRIMARY KEY)")
+        self.conn.execute("DELETE FROM buscados")
+        self.conn.executemany("INSERT OR IGNORE INTO buscados (id) VALUES (?)", ((int(c),) for c in claves))
+        resultado = {}
+        for clave, fila in self.conn.execute(
+                "SELECT ids.id, ids.fila FROM ids JOIN buscados ON ids.id = buscados.id "
+                "WHERE ids.tipo = ? ORDER BY ids.fila", (tipo,)):
+            resultado.setdefault(clave, []).append(fila)
+        return resultado
+
+    def contar(self, tipo):
+        """Cantidad de IDs distintos de un tipo en el libro."""
+        return self.conn.execute("SELECT COUNT(DISTINCT id) FROM ids WHERE tipo = ?", (tipo,)).fetchone()[0]
+
+    def _marcar_modificado(self):
+        # Mientras el libro modificado no se guarde, el índice no debe considerarse vigente
+        if not self._modificado:
+            self._set_meta('sello', None)
+            self.conn.commit()
+            self._modificado = True
+
+    def desplazar(self, desde_fila, cantidad):
+        """Registra la inserción de `cantidad` filas en `desde_fila` (las filas siguientes se recorren)."""
+        self._marcar_modificado()
+        self.conn.execute("UPDATE ids SET fila = fila + ? WHERE fila >= ?", (cantidad, desde_fila))
+
+    def reindexar_fila(self, ws, fila):
+        """Vuelve a leer los IDs y el consecutivo de una fila modificada o insertada."""
+        self._marcar_modificado()
+        self.conn.execute("DELETE FROM ids WHERE fila = ?", (fila,))
+        self.conn.executemany("INSERT INTO ids (tipo, id, fila) VALUES (?, ?, ?)", self._leer_fila(ws, fila))
+        self._ampliar_consecutivo(ws.cell(row=fila, column=particiones.COL_CONSECUTIVO).value)
+
+    def sellar(self):
+        """Registra el estado actual del libro en disco; llamar después de guardarlo."""
+        self._set_meta('sello', particiones.sello_libro(self.workbook_path))
+        self.conn.commit()
+        self._modificado = False
+
+    def cerrar(self):
+        self.conn.close()
+
+
+def reconstruir_indices(base_path):
+    """Reconstruye el índice del concentrado combinado o, si está particionado, el de cada partición."""
+    manifest = particiones.cargar_manifest(base_path)
+    for workbook_path in particiones.libros_concentrado(base_path, manifest):
+        if not workbook_path.exists():
+            print(f"No se encontró el archivo {workbook_path.name}")
+            continue
+        wb = openpyxl.load_workbook(workbook_path, read_only=True)
+        indice = IndiceConcentrado(workbook_path)
+        registros = indice.reconstruir(wb.active)
+        print(f"- {workbook_path.name}: {registros} IDs indexados, mayor consecutivo {indice.max_consecutive}")
+        indice.cerrar()
+        wb.close()
+
+
+if __name__ == "__main__":
+    print("Reconstruyendo índices del concentrado...")
+    reconstruir_indices(Path.cwd())
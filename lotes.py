@@ -0,0 +1,387 @@
+import argparse
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+# Etapas del flujo de trabajo, en el orden en que deben ejecutarse para cada cuenta
+ETAPAS = {
+    'extract': 'extract.py',
+    'cruce1r': 'cruce1r.py',
+    'cruce2m': 'cruce2m.py',
+}
+COLA_DEFAULT = 'cola_lotes.sqlite'
+REINTENTOS_DEFAULT = 2
+EXPIRACION_DEFAULT = 3600  # Segundos sin latido tras los cuales un trabajo en proceso se considera abandonado
+INTERVALO_LATIDO = 30      # Cada cuántos segundos el trabajador confirma que su proceso sigue activo
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+
+class ColaTrabajos:
+    """
+    Cola de trabajos persistente en SQLite, compartible entre procesos y equipos.
+
+    Cada cuenta (carpeta con MERCADOPDF, REPORTE-ML, MERCADOEXCEL y RESULTADO-FINAL) genera
+    un trabajo por etapa, y todos los trabajos de una misma llamada a `encolar` forman un lote.
+    Una etapa solo se entrega cuando las anteriores de la misma cuenta y del mismo lote están
+    completadas, así que nunca hay dos trabajos de una cuenta ejecutándose a la vez. Mientras
+    un trabajo se ejecuta, su trabajador actualiza el latido; solo se recupera un trabajo en
+    proceso cuyo latido quedó vencido.
+    """
+
+    def __init__(self, cola_path):
+        self.cola_path = Path(cola_path)
+        self.conn = sqlite3.connect(self.cola_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA busy_timeout = 60000")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS trabajos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cuenta TEXT NOT NULL,
+                etapa TEXT NOT NULL,
+                orden INTEGER NOT NULL,
+                estado TEXT NOT NULL DEFAULT 'pendiente',
+                intentos INTEGER NOT NULL DEFAULT 0,
+                max_intentos INTEGER NOT NULL,
+                trabajador TEXT,
+                lote TEXT,
+                inicio REAL,
+                latido REAL,
+                fin REAL,
+                error TEXT,
+                log TEXT
+            );
+            CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado);
+            CREATE INDEX IF NOT EXISTS trabajos_cuenta ON trabajos (cuenta, orden);
+        """)
+        # Colas creadas antes de que existieran los lotes y el latido
+        columnas = {row[1] for row in self.conn.execute("PRAGMA table_info(trabajos)")}
+        for columna, tipo in (('lote', 'TEXT'), ('latido', 'REAL')):
+            if columna not in columnas:
+                self.conn.execute(f"ALTER TABLE trabajos ADD COLUMN {columna} {tipo}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS trabajos_lote ON trabajos (lote, cuenta, orden)")
+
+    def encolar(self, cuentas, etapas, reintentos=REINTENTOS_DEFAULT):
+        """
+        Agrega los trabajos de cada cuenta como un lote nuevo. Las cuentas con trabajos sin terminar
+        no se duplican. Devuelve (cuentas agregadas, identificador del lote).
+        """
+        lote = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        agregadas = 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for cuenta in cuentas:
+                cuenta = str(Path(cuenta).resolve())
+                activos = self.conn.execute(
+                    "SELECT COUNT(*) FROM trabajos WHERE cuenta = ? AND estado IN ('pendiente', 'en_proceso')",
+                    (cuenta,)).fetchone()[0]
+                if activos:
+                    print(f"- {cuenta}: ya tiene trabajos pendientes, se omite")
+                    continue
+                for orden, etapa in enumerate(etapas):
+                    self.conn.execute(
+                        "INSERT INTO trabajos (cuenta, etapa, orden, max_intentos, lote) VALUES (?, ?, ?, ?, ?)",
+                        (cuenta, etapa, orden, reintentos + 1, lote))
+                agregadas += 1
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return agregadas, lote
+
+    def tomar(self, trabajador, expiracion=EXPIRACION_DEFAULT):
+        """Reserva el siguiente trabajo disponible. Devuelve (id, cuenta, etapa) o None si no hay."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Los trabajos cuyo trabajador dejó de dar latido vuelven a la cola mientras les queden
+            # intentos; los que ya agotaron sus intentos se dan por fallidos
+            vencidos = self.conn.execute(
+                "SELECT id, intentos, max_intentos FROM trabajos "
+                "WHERE estado = 'en_proceso' AND COALESCE(latido, inicio) < ?",
+                (time.time() - expiracion,)).fetchall()
+            for trabajo_id, intentos, max_intentos in vencidos:
+                if intentos < max_intentos:
+                    self.conn.execute(
+                        "UPDATE trabajos SET estado = 'pendiente', trabajador = NULL WHERE id = ?", (trabajo_id,))
+                else:
+                    self._marcar_fallido(trabajo_id, "El trabajador dejó de responder")
+            row = self.conn.execute("""
+                SELECT t.id, t.cuenta, t.etapa FROM trabajos t
+                WHERE t.estado = 'pendiente'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM trabajos p
+                      WHERE p.cuenta = t.cuenta AND p.lote IS t.lote
+                        AND p.orden < t.orden AND p.estado != 'completado')
+                ORDER BY t.id LIMIT 1
+            """).fetchone()
+            if row is not None:
+                ahora = time.time()
+                self.conn.execute(
+                    "UPDATE trabajos SET estado = 'en_proceso', trabajador = ?, inicio = ?, latido = ?, fin = NULL, "
+                    "intentos = intentos + 1 WHERE id = ?", (trabajador, ahora, ahora, row[0]))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def latir(self, trabajo_id, trabajador):
+        """Confirma que el trabajo sigue en ejecución para que no se considere abandonado."""
+        self.conn.execute("UPDATE trabajos SET latido = ? WHERE id = ? AND estado = 'en_proceso' AND trabajador = ?",
+                          (time.time(), trabajo_id, trabajador))
+
+    def _marcar_fallido(self, trabajo_id, error, log_path=None):
+        cuenta, lote, orden = self.conn.execute(
+            "SELECT cuenta, lote, orden FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        self.conn.execute(
+            "UPDATE trabajos SET estado = 'fallido', fin = ?, error = ?, log = COALESCE(?, log) WHERE id = ?",
+            (time.time(), error, None if log_path is None else str(log_path), trabajo_id))
+        # Las etapas siguientes de la cuenta en el mismo lote ya no pueden ejecutarse
+        self.conn.execute(
+            "UPDATE trabajos SET estado = 'omitido' "
+            "WHERE cuenta = ? AND lote IS ? AND orden > ? AND estado = 'pendiente'", (cuenta, lote, orden))
+
+    def terminar(self, trabajo_id, trabajador, exito, log_path, error=None):
+        """
+        Registra el resultado. Un fallo vuelve a la cola hasta agotar los intentos. Devuelve el
+        estado en que queda el trabajo ('completado', 'pendiente' o 'fallido'), o None si ya no
+        pertenece a este trabajador (se recuperó por falta de latido) y el resultado se descarta.
+        """
+        estado = None
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT intentos, max_intentos FROM trabajos WHERE id = ? AND estado = 'en_proceso' AND trabajador = ?",
+                (trabajo_id, trabajador)).fetchone()
+            if row is None:
+                pass  # Otro trabajador ya tiene el trabajo
+            elif exito:
+                estado = 'completado'
+                self.conn.execute(
+                    "UPDATE trabajos SET estado = 'completado', fin = ?, error = NULL, log = ? WHERE id = ?",
+                    (time.time(), str(log_path), trabajo_id))
+            elif row[0] < row[1]:
+                estado = 'pendiente'
+                self.conn.execute(
+                    "UPDATE trabajos SET estado = 'pendiente', fin = ?, error = ?, log = ? WHERE id = ?",
+                    (time.time(), error, str(log_path), trabajo_id))
+            else:
+                estado = 'fallido'
+                self._marcar_fallido(trabajo_id, error, log_path)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return estado
+
+    def hay_pendientes(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM trabajos WHERE estado IN ('pendiente', 'en_proceso')").fetchone()[0] > 0
+
+    def resultados(self):
+        """Trabajos del último lote de cada cuenta (los lotes anteriores quedan como historial)."""
+        return self.conn.execute("""
+            SELECT t.cuenta, t.etapa, t.estado, t.intentos, t.inicio, t.fin, t.error, t.log FROM trabajos t
+            WHERE t.lote IS (SELECT u.lote FROM trabajos u WHERE u.cuenta = t.cuenta ORDER BY u.id DESC LIMIT 1)
+            ORDER BY t.cuenta, t.orden
+        """).fetchall()
+
+    def cerrar(self):
+        self.conn.close()
+
+
+def hay_pdfs(cuenta):
+    carpeta = Path(cuenta) / 'MERCADOPDF'
+    return carpeta.is_dir() and any(f.suffix == '.pdf' for f in carpeta.iterdir())
+
+
+def ejecutar_trabajo(cuenta, etapa, latir=None, intervalo=INTERVALO_LATIDO):
+    """
+    Ejecuta una etapa como proceso independiente con la carpeta de la cuenta como directorio
+    de trabajo, de modo que cada cuenta queda aislada. La salida se guarda en un log de la cuenta.
+    Mientras el proceso sigue activo se llama a `latir` cada `intervalo` segundos.
+    """
+    log_path = Path(cuenta) / f"lotes_{etapa}.log"
+    script = SCRIPTS_DIR / ETAPAS[etapa]
+    with open(log_path, 'w', encoding='utf-8') as log:
+        log.write(f"=== {etapa} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n")
+        if etapa == 'extract' and not hay_pdfs(cuenta):
+            # Una cuenta sin estados de cuenta nuevos puede tener reportes por cruzar
+            log.write("No hay PDFs en MERCADOPDF; no hay nada que extraer.\n")
+            return True, log_path, None
+        log.flush()
+        proceso = subprocess.Popen([sys.executable, str(script)], cwd=cuenta, stdout=log,
+                                   stderr=subprocess.STDOUT, env={**os.environ, 'PYTHONIOENCODING': 'utf-8'})
+        while True:
+            try:
+                returncode = proceso.wait(timeout=intervalo)
+                break
+            except subprocess.TimeoutExpired:
+                if latir is not None:
+                    latir()
+    error = None if returncode == 0 else f"Código de salida {returncode}"
+    return returncode == 0, log_path, error
+
+
+def trabajador(cola_path, nombre, expiracion, espera):
+    """
+    Toma trabajos de la cola hasta que no quede ninguno pendiente. Devuelve (terminados, intentos):
+    los trabajos que este trabajador dejó completados o fallidos y las ejecuciones, reintentos incluidos.
+    """
+    cola = ColaTrabajos(cola_path)
+    terminados = 0
+    intentos = 0
+    try:
+        while True:
+            trabajo = cola.tomar(nombre, expiracion)
+            if trabajo is None:
+                if not cola.hay_pendientes():
+                    break
+                # Hay etapas esperando a que termine la anterior de su cuenta
+                time.sleep(espera)
+                continue
+            trabajo_id, cuenta, etapa = trabajo
+            print(f"[{nombre}] {etapa} -> {cuenta}")
+            try:
+                exito, log_path, error = ejecutar_trabajo(
+                    cuenta, etapa, latir=lambda: cola.latir(trabajo_id, nombre),
+                    intervalo=min(INTERVALO_LATIDO, expiracion / 3))
+            except Exception as e:
+                exito, log_path, error = False, '', str(e)
+            intentos += 1
+            estado = cola.terminar(trabajo_id, nombre, exito, log_path, error)
+            if estado is None:
+                print(f"[{nombre}] {etapa} -> {cuenta}: el trabajo se reasignó, se descarta el resultado")
+                continue
+            if estado != 'pendiente':
+                terminados += 1
+            resultado = "completado" if exito else f"falló ({error})"
+            print(f"[{nombre}] {etapa} -> {cuenta}: {resultado}")
+    finally:
+        cola.cerrar()
+    return terminados, intentos
+
+
+def trabajar(cola_path, workers, expiracion=EXPIRACION_DEFAULT, espera=1.0):
+    """Procesa la cola con un grupo de `workers` trabajadores locales."""
+    prefijo = f"{socket.gethostname()}:{os.getpid()}"
+    inicio = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futuros = [pool.submit(trabajador, cola_path, f"{prefijo}:{i}", expiracion, espera)
+                   for i in range(1, workers + 1)]
+        resultados = [f.result() for f in futuros]
+    terminados = sum(r[0] for r in resultados)
+    intentos = sum(r[1] for r in resultados)
+    return terminados, intentos, time.time() - inicio
+
+
+def reportar(cola_path, duracion=None, terminados=None, intentos_ejecutados=None):
+    cola = ColaTrabajos(cola_path)
+    resultados = cola.resultados()
+    cola.cerrar()
+
+    por_estado = {}
+    por_etapa = {}
+    cuentas = {}
+    for cuenta, etapa, estado, intentos, inicio, fin, error, log in resultados:
+        por_estado[estado] = por_estado.get(estado, 0) + 1
+        cuentas.setdefault(cuenta, []).append((etapa, estado, intentos, error, log))
+        if estado == 'completado' and inicio and fin:
+            total, cantidad = por_etapa.get(etapa, (0.0, 0))
+            por_etapa[etapa] = (total + fin - inicio, cantidad + 1)
+
+    cuentas_ok = [c for c, etapas in cuentas.items() if all(e[1] == 'completado' for e in etapas)]
+    cuentas_fallidas = [c for c, etapas in cuentas.items() if any(e[1] == 'fallido' for e in etapas)]
+
+    print("\n" + "="*50)
+    print("           REPORTE DE PROCESAMIENTO POR LOTES           ")
+    print("="*50)
+    print("\n[RESUMEN GENERAL]")
+    print(f"- Cuentas en la cola: {len(cuentas)}")
+    print(f"- Cuentas completadas: {len(cuentas_ok)}")
+    print(f"- Cuentas con fallos: {len(cuentas_fallidas)}")
+    for estado in ('completado', 'pendiente', 'en_proceso', 'fallido', 'omitido'):
+        print(f"- Trabajos {estado}: {por_estado.get(estado, 0)}")
+
+    print("\n[RENDIMIENTO]")
+    if duracion:
+        print(f"- Tiempo total de esta ejecución: {duracion:.1f} s")
+        print(f"- Trabajos terminados en esta ejecución (completados o fallidos): {terminados}")
+        print(f"- Intentos ejecutados (incluye reintentos): {intentos_ejecutados}")
+        print(f"- Trabajos por minuto: {terminados / duracion * 60:.1f}")
+    for etapa, (total, cantidad) in por_etapa.items():
+        print(f"- {etapa}: {cantidad} trabajos, promedio {total / cantidad:.1f} s")
+
+    if cuentas_fallidas:
+        print("\n[CUENTAS CON FALLOS]")
+        for cuenta in cuentas_fallidas:
+            for etapa, estado, intentos, error, log in cuentas[cuenta]:
+                if estado == 'fallido':
+                    print(f"- {cuenta} ({etapa}, {intentos} intentos): {error}. Ver {log}")
+    print("="*50)
+
+
+def leer_cuentas(args):
+    cuentas = list(args.cuentas)
+    if args.archivo:
+        with open(args.archivo, encoding='utf-8') as f:
+            cuentas.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    validas = []
+    for cuenta in cuentas:
+        if Path(cuenta).is_dir():
+            validas.append(cuenta)
+        else:
+            print(f"Advertencia: la carpeta de cuenta {cuenta} no existe")
+    return validas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Procesa varias cuentas de vendedor con una cola de trabajos compartida")
+    parser.add_argument('--cola', default=COLA_DEFAULT, help="Archivo SQLite de la cola de trabajos")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    def _args_encolar(p):
+        p.add_argument('cuentas', nargs='*', help="Carpetas raíz de las cuentas")
+        p.add_argument('--archivo', help="Archivo de texto con una carpeta de cuenta por línea")
+        p.add_argument('--etapas', nargs='+', choices=list(ETAPAS), default=list(ETAPAS),
+                       help="Etapas a ejecutar, en orden")
+        p.add_argument('--reintentos', type=int, default=REINTENTOS_DEFAULT,
+                       help="Reintentos por trabajo antes de marcarlo como fallido")
+
+    def _args_trabajar(p):
+        p.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                       help="Cantidad de trabajadores locales (por defecto, uno por núcleo)")
+        p.add_argument('--expiracion', type=int, default=EXPIRACION_DEFAULT,
+                       help="Segundos sin latido tras los cuales un trabajo en proceso se devuelve a la cola")
+
+    _args_encolar(subparsers.add_parser('encolar', help="Agrega cuentas a la cola"))
+    _args_trabajar(subparsers.add_parser('trabajar', help="Procesa la cola con trabajadores locales"))
+    p_ejecutar = subparsers.add_parser('ejecutar', help="Encola las cuentas y procesa la cola")
+    _args_encolar(p_ejecutar)
+    _args_trabajar(p_ejecutar)
+    subparsers.add_parser('reporte', help="Muestra el estado de la cola")
+    args = parser.parse_args()
+
+    if args.comando in ('encolar', 'ejecutar'):
+        cuentas = leer_cuentas(args)
+        cola = ColaTrabajos(args.cola)
+        agregadas, lote = cola.encolar(cuentas, args.etapas, args.reintentos)
+        cola.cerrar()
+        print(f"Se encolaron {agregadas} cuentas en {args.cola} (lote {lote})")
+
+    if args.comando in ('trabajar', 'ejecutar'):
+        print(f"Iniciando {args.workers} trabajadores...")
+        terminados, intentos, duracion = trabajar(args.cola, args.workers, args.expiracion)
+        print(f"\nTrabajos terminados por este equipo: {terminados} ({intentos} intentos)")
+        reportar(args.cola, duracion, terminados, intentos)
+    elif args.comando == 'reporte':
+        reportar(args.cola)
+
+
+if __name__ == "__main__":
+    main()
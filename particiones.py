@@ -0,0 +1,321 @@
+import argparse
+import json
+from copy import copy
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+
+import ids
+
+# Ubicación del concentrado combinado y de su versión particionada
+CONCENTRADO_NOMBRE = 'CONCENTRADO-MERCADOLIBRE.xlsx'
+CARPETA_PARTICIONES = 'PARTICIONES'
+MANIFEST_NOMBRE = 'manifest.json'
+TAMANO_PERIODO_DEFAULT = 500
+
+# Columnas del concentrado usadas para indexar las particiones
+COL_ORDEN = 1         # A: ORDEN ML (16 dígitos)
+COL_CONSECUTIVO = 2   # B: CONSECUTIVO SICAR
+COL_OPERACION = 9     # I: ID DE OPERACIÓN EN MERCADO PAGO (11 dígitos)
+
+
+def ruta_concentrado(base_path):
+    return Path(base_path).joinpath('RESULTADO-FINAL', CONCENTRADO_NOMBRE)
+
+
+def ruta_particiones(base_path):
+    return Path(base_path).joinpath('RESULTADO-FINAL', CARPETA_PARTICIONES)
+
+
+def cargar_manifest(base_path):
+    """
+    Carga el manifest de particiones. Devuelve None si el concentrado no está particionado.
+    Las particiones modificadas fuera de los scripts se detectan por su sello y sus rangos se recalculan.
+    """
+    manifest_path = ruta_particiones(base_path) / MANIFEST_NOMBRE
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if refrescar_manifest(base_path, manifest):
+        guardar_manifest(base_path, manifest)
+    return manifest
+
+
+def guardar_manifest(base_path, manifest):
+    manifest_path = ruta_particiones(base_path) / MANIFEST_NOMBRE
+    manifest['actualizado'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    tmp_path = manifest_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    tmp_path.replace(manifest_path)
+
+
+def libros_concentrado(base_path, manifest):
+    """Libros que forman el concentrado: el combinado o, si está particionado, cada partición del manifest."""
+    if manifest is None:
+        return [ruta_concentrado(base_path)]
+    carpeta = ruta_particiones(base_path)
+    return [carpeta / entrada['archivo'] for entrada in manifest['particiones']]
+
+
+def sello_libro(workbook_path):
+    """Fecha de modificación y tamaño del libro, para detectar ediciones fuera de los scripts."""
+    stat = Path(workbook_path).stat()
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def refrescar_manifest(base_path, manifest):
+    """
+    Recalcula los rangos de las particiones cuyo libro cambió desde que se registraron en el manifest.
+    Devuelve los nombres de las particiones refrescadas.
+    """
+    carpeta = ruta_particiones(base_path)
+    refrescadas = []
+    for entrada in manifest['particiones']:
+        partition_path = carpeta / entrada['archivo']
+        if not partition_path.exists() or entrada.get('sello') == sello_libro(partition_path):
+            continue
+        wb = openpyxl.load_workbook(partition_path, read_only=True)
+        actualizar_entrada(manifest, entrada, wb.active, partition_path)
+        wb.close()
+        refrescadas.append(entrada['archivo'])
+    if refrescadas:
+        print(f"Rangos recalculados para particiones modificadas: {', '.join(refrescadas)}")
+    return refrescadas
+
+
+def resumir_hoja(ws):
+    """
+    Calcula los rangos que el manifest guarda para una partición:
+    consecutivos, IDs de orden (columna A) e IDs de operación (columna I).
+    """
+    resumen = {
+        'filas': 0,
+        'consecutivo_min': None, 'consecutivo_max': None,
+        'orden_min': None, 'orden_max': None,
+        'operacion_min': None, 'operacion_max': None,
+    }
+
+    def _ampliar(campo, valor):
+        if valor is None:
+            return
+        minimo, maximo = f'{campo}_min', f'{campo}_max'
+        if resumen[minimo] is None or valor < resumen[minimo]:
+            resumen[minimo] = valor
+        if resumen[maximo] is None or valor > resumen[maximo]:
+            resumen[maximo] = valor
+
+    for row in ws.iter_rows(min_row=2, max_col=COL_OPERACION, values_only=True):
+        if all(v is None for v in row):
+            continue
+        resumen['filas'] += 1
+        consecutivo = row[COL_CONSECUTIVO - 1]
+        if isinstance(consecutivo, (int, float)):
+            _ampliar('consecutivo', int(consecutivo))
+        _ampliar('orden', ids.id_numerico(row[COL_ORDEN - 1], ids.DIGITOS_ORDEN))
+        if len(row) >= COL_OPERACION:
+            _ampliar('operacion', ids.id_numerico(row[COL_OPERACION - 1], ids.DIGITOS_OPERACION))
+    return resumen
+
+
+def particiones_candidatas(manifest, claves, campo):
+    """
+    Devuelve las particiones cuyo rango de `campo` ('orden' u 'operacion')
+    puede contener alguna de las claves enteras recibidas.
+    """
+    claves = np.sort(np.fromiter((int(c) for c in claves), dtype=np.int64))
+    if not len(claves):
+        return []
+    candidatas = []
+    for entrada in manifest['particiones']:
+        minimo, maximo = entrada.get(f'{campo}_min'), entrada.get(f'{campo}_max')
+        if minimo is None or maximo is None:
+            continue
+        # Primera clave >= minimo en el arreglo ordenado
+        pos = np.searchsorted(claves, minimo)
+        if pos < len(claves) and claves[pos] <= maximo:
+            candidatas.append(entrada)
+    return candidatas
+
+
+def actualizar_entrada(manifest, entrada, ws, workbook_path):
+    """
+    Refresca los rangos de una partición modificada y el consecutivo máximo global.
+    Llamar después de guardar el libro, para registrar su sello.
+    """
+    entrada.update(resumir_hoja(ws))
+    entrada['sello'] = sello_libro(workbook_path)
+    if entrada['consecutivo_max'] is not None:
+        manifest['max_consecutive'] = max(manifest.get('max_consecutive') or 0, entrada['consecutivo_max'])
+
+
+def guardar_con_backup(wb, path):
+    """Guarda un backup con marca de tiempo junto al archivo y después el archivo mismo."""
+    path = Path(path)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_path = path.parent / f"{path.stem}_backup_{timestamp}{path.suffix}"
+    wb.save(backup_path)
+    wb.save(path)
+    return backup_path
+
+
+def _copiar_fila(ws_origen, num_fila, ws_destino, fila_destino):
+    for cell in ws_origen[num_fila]:
+        destino = ws_destino.cell(row=fila_destino, column=cell.column, value=cell.value)
+        if cell.has_style:
+            # Los estilos pertenecen a cada libro, así que se copian atributo por atributo
+            destino.font = copy(cell.font)
+            destino.fill = copy(cell.fill)
+            destino.border = copy(cell.border)
+            destino.alignment = copy(cell.alignment)
+            destino.protection = copy(cell.protection)
+            destino.number_format = cell.number_format
+    if ws_origen.row_dimensions[num_fila].height is not None:
+        ws_destino.row_dimensions[fila_destino].height = ws_origen.row_dimensions[num_fila].height
+
+
+def _copiar_formato_hoja(ws_origen, ws_destino):
+    """Copia el encabezado con su estilo, los anchos de columna, los paneles fijos y el formato condicional."""
+    ws_destino.title = ws_origen.title
+    _copiar_fila(ws_origen, 1, ws_destino, 1)
+    for letra, dimension in ws_origen.column_dimensions.items():
+        destino = ws_destino.column_dimensions[letra]
+        destino.min, destino.max = dimension.min, dimension.max
+        destino.width = dimension.width
+        destino.hidden = dimension.hidden
+    ws_destino.freeze_panes = ws_origen.freeze_panes
+    ws_destino.auto_filter.ref = ws_origen.auto_filter.ref
+    for rango in ws_origen.conditional_formatting:
+        for regla in rango.rules:
+            ws_destino.conditional_formatting.add(str(rango.sqref), copy(regla))
+
+
+def particionar(base_path, tamano=TAMANO_PERIODO_DEFAULT):
+    """
+    Divide el concentrado combinado en libros por periodo. Un periodo es un bloque
+    de `tamano` consecutivos SICAR; las filas sin consecutivo quedan en el periodo
+    de la fila anterior para que las filas de una misma orden no se separen.
+    """
+    concentrado_path = ruta_concentrado(base_path)
+    if not concentrado_path.exists():
+        print(f"No se encontró el archivo {CONCENTRADO_NOMBRE}")
+        return
+    carpeta = ruta_particiones(base_path)
+    if (carpeta / MANIFEST_NOMBRE).exists():
+        print(f"Ya existe un concentrado particionado en {carpeta}. Use 'exportar' y elimine la carpeta para volver a particionar.")
+        return
+    carpeta.mkdir(parents=True, exist_ok=True)
+
+    wb = openpyxl.load_workbook(concentrado_path)
+    ws = wb.active
+    encabezado = [cell.value for cell in ws[1]]
+
+    filas_por_periodo = {}
+    periodo_actual = 0
+    for num_fila in range(2, ws.max_row + 1):
+        if all(cell.value is None for cell in ws[num_fila]):
+            continue
+        consecutivo = ws.cell(row=num_fila, column=COL_CONSECUTIVO).value
+        if isinstance(consecutivo, (int, float)):
+            periodo_actual = int(consecutivo) // tamano
+        filas_por_periodo.setdefault(periodo_actual, []).append(num_fila)
+
+    manifest = {
+        'version': 1,
+        'tamano_periodo': tamano,
+        'max_consecutive': 0,
+        'encabezado': encabezado,
+        'particiones': [],
+    }
+    for periodo in sorted(filas_por_periodo):
+        wb_part = openpyxl.Workbook()
+        ws_part = wb_part.active
+        _copiar_formato_hoja(ws, ws_part)
+        for destino, num_fila in enumerate(filas_por_periodo[periodo], start=2):
+            _copiar_fila(ws, num_fila, ws_part, destino)
+        archivo = f"CONCENTRADO-P{periodo:04d}.xlsx"
+        wb_part.save(carpeta / archivo)
+        entrada = {'archivo': archivo, 'periodo': periodo}
+        actualizar_entrada(manifest, entrada, ws_part, carpeta / archivo)
+        manifest['particiones'].append(entrada)
+        print(f"- {archivo}: {entrada['filas']} filas (consecutivos {entrada['consecutivo_min']} a {entrada['consecutivo_max']})")
+        wb_part.close()
+    wb.close()
+
+    guardar_manifest(base_path, manifest)
+    print(f"\nSe crearon {len(manifest['particiones'])} particiones en {carpeta}")
+    print(f"Mayor consecutivo: {manifest['max_consecutive']}")
+
+
+def exportar(base_path):
+    """
+    Reconstruye CONCENTRADO-MERCADOLIBRE.xlsx concatenando las particiones en orden de periodo.
+    El encabezado y el formato de la hoja se toman de la primera partición.
+    """
+    manifest = cargar_manifest(base_path)
+    if manifest is None:
+        print("No se encontró un concentrado particionado")
+        return
+    carpeta = ruta_particiones(base_path)
+    concentrado_path = ruta_concentrado(base_path)
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(manifest['encabezado'])
+    fila_destino = 2
+    for entrada in sorted(manifest['particiones'], key=lambda e: e['periodo']):
+        wb_part = openpyxl.load_workbook(carpeta / entrada['archivo'])
+        ws_part = wb_part.active
+        if fila_destino == 2:
+            _copiar_formato_hoja(ws_part, ws)
+        for num_fila in range(2, ws_part.max_row + 1):
+            _copiar_fila(ws_part, num_fila, ws, fila_destino)
+            fila_destino += 1
+        wb_part.close()
+
+    if concentrado_path.exists():
+        backup_path = concentrado_path.parent / f"CONCENTRADO-MERCADOLIBRE_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        concentrado_path.replace(backup_path)
+        print(f"Backup creado en: {backup_path}")
+    wb.save(concentrado_path)
+    wb.close()
+    print(f"Se exportaron {fila_destino - 2} filas a {concentrado_path}")
+
+
+def refrescar(base_path):
+    """Recalcula los rangos de todas las particiones, hayan cambiado o no."""
+    manifest = cargar_manifest(base_path)
+    if manifest is None:
+        print("No se encontró un concentrado particionado")
+        return
+    for entrada in manifest['particiones']:
+        entrada.pop('sello', None)
+    refrescar_manifest(base_path, manifest)
+    guardar_manifest(base_path, manifest)
+    print(f"Manifest actualizado. Mayor consecutivo: {manifest['max_consecutive']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Administra el concentrado particionado por periodos")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    p_particionar = subparsers.add_parser('particionar', help="Divide el concentrado combinado en particiones")
+    p_particionar.add_argument('--tamano', type=int, default=TAMANO_PERIODO_DEFAULT,
+                               help="Cantidad de consecutivos SICAR por periodo")
+    subparsers.add_parser('exportar', help="Reconstruye el concentrado combinado a partir de las particiones")
+    subparsers.add_parser('refrescar', help="Recalcula los rangos del manifest a partir de todas las particiones")
+    args = parser.parse_args()
+
+    base_path = Path.cwd()
+    if args.comando == 'particionar':
+        particionar(base_path, args.tamano)
+    elif args.comando == 'refrescar':
+        refrescar(base_path)
+    else:
+        exportar(base_path)
+
+
+if __name__ == "__main__":
+    main()
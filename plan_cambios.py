@@ -0,0 +1,114 @@
+import csv
+from datetime import datetime
+
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+
+def formato_numerico(valor):
+    """Formato que los cruces aplican a los valores numéricos: '0.00' con decimales, '0' para enteros."""
+    if isinstance(valor, (int, float)):
+        if isinstance(valor, float) and not valor.is_integer():
+            return "0.00"
+        return "0"
+    return None
+
+
+def _vacio(valor):
+    # Las celdas con NaN, NaT o NA se guardan vacías, así que todos se consideran iguales a None
+    return valor is None or (pd.api.types.is_scalar(valor) and bool(pd.isna(valor)))
+
+
+def valores_iguales(actual, nuevo):
+    if _vacio(actual) or _vacio(nuevo):
+        return _vacio(actual) and _vacio(nuevo)
+    try:
+        return bool(actual == nuevo)
+    except Exception:
+        return False
+
+
+class PlanCambios:
+    """
+    Plan de cambios de una hoja del concentrado: celdas (valor anterior -> nuevo) y filas a insertar.
+
+    El plan se calcula contra la hoja sin modificarla; las asignaciones que dejarían la celda
+    igual no se registran. Las coordenadas son las de la hoja original: al aplicar, primero se
+    escriben las celdas y luego se insertan las filas de abajo hacia arriba para que cada
+    inserción no recorra a las demás.
+    """
+
+    def __init__(self, archivo):
+        self.archivo = archivo
+        self.celdas = []       # (fila, columna, anterior, nuevo, formato)
+        self.inserciones = []  # (fila_insercion, [valores por fila], columna desde la que se aplica formato)
+
+    def asignar(self, ws, fila, columna, valor, formato=None):
+        """Registra la asignación si cambia el valor o el formato. Devuelve True si se registró."""
+        cell = ws.cell(row=fila, column=columna)
+        if valores_iguales(cell.value, valor) and (formato is None or cell.number_format == formato):
+            return False
+        self.celdas.append((fila, columna, cell.value, valor, formato))
+        return True
+
+    def insertar(self, fila_insercion, filas, formatear_desde=1):
+        """Registra la inserción de `filas` (listas de valores desde la columna A) en `fila_insercion`."""
+        self.inserciones.append((fila_insercion, filas, formatear_desde))
+
+    def vacio(self):
+        return not self.celdas and not self.inserciones
+
+    @property
+    def filas_insertadas(self):
+        return sum(len(filas) for _, filas, _ in self.inserciones)
+
+    def aplicar(self, ws, indice_concentrado=None):
+        """Aplica el plan a la hoja y, si se indica, mantiene actualizado el índice del libro."""
+        for fila, columna, _, nuevo, formato in self.celdas:
+            cell = ws.cell(row=fila, column=columna, value=nuevo)
+            if formato:
+                cell.number_format = formato
+        if indice_concentrado is not None:
+            for fila in sorted({c[0] for c in self.celdas}):
+                indice_concentrado.reindexar_fila(ws, fila)
+
+        for fila_insercion, filas, formatear_desde in sorted(self.inserciones, key=lambda i: i[0], reverse=True):
+            ws.insert_rows(fila_insercion, amount=len(filas))
+            if indice_concentrado is not None:
+                indice_concentrado.desplazar(fila_insercion, len(filas))
+            for i, valores in enumerate(filas):
+                target_row = fila_insercion + i
+                for col_idx, value in enumerate(valores, start=1):
+                    cell = ws.cell(row=target_row, column=col_idx, value=value)
+                    formato = formato_numerico(value) if col_idx >= formatear_desde else None
+                    if formato:
+                        cell.number_format = formato
+                if indice_concentrado is not None:
+                    indice_concentrado.reindexar_fila(ws, target_row)
+
+    def resumen(self):
+        return f"{len(self.celdas)} celdas a modificar, {self.filas_insertadas} filas a insertar"
+
+    def filas_reporte(self):
+        for fila, columna, anterior, nuevo, _ in self.celdas:
+            yield [self.archivo, 'celda', fila, get_column_letter(columna), anterior, nuevo]
+        for fila_insercion, filas, _ in self.inserciones:
+            for i, valores in enumerate(filas):
+                for col_idx, value in enumerate(valores, start=1):
+                    if not _vacio(value):
+                        yield [self.archivo, 'fila nueva', f"{fila_insercion}+{i}", get_column_letter(col_idx), None, value]
+
+
+def exportar_planes(planes, ruta):
+    """Guarda los planes como reporte CSV de simulación (una línea por celda)."""
+    with open(ruta, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Archivo', 'Tipo', 'Fila', 'Columna', 'Valor anterior', 'Valor nuevo'])
+        for plan in planes:
+            for fila in plan.filas_reporte():
+                writer.writerow(['' if v is None else v for v in fila])
+
+
+def ruta_reporte_simulacion(base_path, script):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return base_path / f"PLAN-CAMBIOS_{script}_{timestamp}.csv"